@@ -2,22 +2,37 @@
 It provides a platform for comparing the responses of two LLMs. 
 """
 import enum
-from uuid import uuid4
+import logging
+import os
+import resource
+import time
 
-from firebase_admin import firestore
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 import gradio as gr
 import lingua
+import uvicorn
 
-from db import db
+import db
+from language import detector
+from language import DETECTOR_PRELOAD
+from language import SUPPORTED_LANGUAGES
 from leaderboard import build_leaderboard
-from leaderboard import SUPPORTED_LANGUAGES
+from leaderboard import schedule_leaderboard_refresh
+from leaderboard import schedule_ratings_materialization
+from metrics import render_metrics
 from model import check_models
+from model import schedule_model_checks
 from model import supported_models
 from rate_limit import set_token
 import response
 from response import get_responses
+from scheduler import shutdown
+import tracing
 
-detector = lingua.LanguageDetectorBuilder.from_all_languages().build()
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
 
 class VoteOptions(enum.Enum):
@@ -26,16 +41,23 @@ class VoteOptions(enum.Enum):
   TIE = "Tie"
 
 
+# `trace_id` is the trace ID of the battle, which the vote is traced under.
 def vote(vote_button, response_a, response_b, model_a_name, model_b_name,
-         prompt, instruction, category, source_lang, target_lang):
-  doc_id = uuid4().hex
+         prompt, instruction, category, source_lang, target_lang, trace_id):
+  with tracing.span("vote", trace_id or None, category=category):
+    return _vote(vote_button, response_a, response_b, model_a_name,
+                 model_b_name, prompt, instruction, category, source_lang,
+                 target_lang, trace_id)
+
+
+def _vote(vote_button, response_a, response_b, model_a_name, model_b_name,
+          prompt, instruction, category, source_lang, target_lang, trace_id):
   winner = VoteOptions(vote_button).name.lower()
 
   deactivated_buttons = [gr.Button(interactive=False) for _ in range(3)]
   outputs = deactivated_buttons + [gr.Row(visible=True)]
 
   doc = {
-      "id": doc_id,
       "prompt": prompt,
       "instruction": instruction,
       "model_a": model_a_name,
@@ -43,18 +65,19 @@ def vote(vote_button, response_a, response_b, model_a_name, model_b_name,
       "model_a_response": response_a,
       "model_b_response": response_b,
       "winner": winner,
-      "timestamp": firestore.SERVER_TIMESTAMP
   }
+  if trace_id:
+    doc["trace_id"] = trace_id
 
   if category == response.Category.SUMMARIZE.value:
-    language_a = detector.detect_language_of(response_a)
-    language_b = detector.detect_language_of(response_b)
+    with tracing.span("detect_language"):
+      language_a = detector.detect_language_of(response_a)
+      language_b = detector.detect_language_of(response_b)
 
-    # TODO(#37): Move DB operations to db.py.
-    doc_ref = db.collection("arena-summarizations").document(doc_id)
     doc["model_a_response_language"] = language_a.name.lower()
     doc["model_b_response_language"] = language_b.name.lower()
-    doc_ref.set(doc)
+    with tracing.span("add_battle"):
+      db.add_battle(db.Category.SUMMARIZATION, doc)
 
     return outputs
 
@@ -62,10 +85,10 @@ def vote(vote_button, response_a, response_b, model_a_name, model_b_name,
     if not source_lang or not target_lang:
       raise gr.Error("Please select source and target languages.")
 
-    doc_ref = db.collection("arena-translations").document(doc_id)
     doc["source_language"] = source_lang.lower()
     doc["target_language"] = target_lang.lower()
-    doc_ref.set(doc)
+    with tracing.span("add_battle"):
+      db.add_battle(db.Category.TRANSLATION, doc)
 
     return outputs
 
@@ -160,24 +183,28 @@ with gr.Blocks(title="Yanolja Arena", css=css) as app:
     tie = gr.Button(VoteOptions.TIE.value)
 
   instruction_state = gr.State("")
+  trace_id_state = gr.State("")
 
   # The following elements need to be reset when the user changes
   # the category, source language, or target language.
   ui_elements = [
       response_boxes[0], response_boxes[1], model_names[0], model_names[1],
-      instruction_state, model_name_row, vote_row
+      instruction_state, trace_id_state, model_name_row, vote_row
   ]
 
   def reset_ui():
-    return [gr.Textbox(value="") for _ in range(4)
-           ] + [gr.State(""),
-                gr.Row(visible=False),
-                gr.Row(visible=False)]
+    return [gr.Textbox(value="") for _ in range(4)] + [
+        gr.State(""),
+        gr.State(""),
+        gr.Row(visible=False),
+        gr.Row(visible=False)
+    ]
 
   category_radio.change(fn=reset_ui, outputs=ui_elements)
   source_language.change(fn=reset_ui, outputs=ui_elements)
   target_language.change(fn=reset_ui, outputs=ui_elements)
 
+  battle_states = [instruction_state, trace_id_state]
   submit_event = submit.click(
       fn=lambda: [
           gr.Radio(interactive=False),
@@ -195,7 +222,7 @@ with gr.Blocks(title="Yanolja Arena", css=css) as app:
                   prompt_textarea, category_radio, source_language,
                   target_language, token
               ],
-              outputs=response_boxes + model_names + [instruction_state])
+              outputs=response_boxes + model_names + battle_states)
   submit_event.success(fn=lambda: gr.Row(visible=True), outputs=vote_row)
   submit_event.then(
       fn=lambda: [
@@ -211,7 +238,7 @@ with gr.Blocks(title="Yanolja Arena", css=css) as app:
         fn=vote,
         inputs=[option_button] + response_boxes + model_names + [
             prompt_textarea, instruction_state, category_radio, source_language,
-            target_language
+            target_language, trace_id_state
         ],
         outputs=[option_a, option_b, tie, model_name_row]).then(
             fn=lambda: [gr.Button(interactive=False) for _ in range(3)],
@@ -222,9 +249,43 @@ with gr.Blocks(title="Yanolja Arena", css=css) as app:
 
   build_leaderboard()
 
+
+# Serves the completion metrics in the Prometheus text format.
+def get_metrics() -> PlainTextResponse:
+  return PlainTextResponse(render_metrics(),
+                           media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
+  start = time.perf_counter()
+  usage = resource.getrusage(resource.RUSAGE_SELF)
+  import_cpu_time = usage.ru_utime + usage.ru_stime
+
   check_models(supported_models)
+  schedule_model_checks(supported_models)
+  schedule_leaderboard_refresh()
+  schedule_ratings_materialization()
+  if DETECTOR_PRELOAD:
+    detector.preload()
+
+  # ru_maxrss is in kilobytes on Linux.
+  logger.info(
+      "Imports took %.2fs of CPU time and startup checks took %.2fs. "
+      "Peak RSS: %.1f MiB.", import_cpu_time,
+      time.perf_counter() - start,
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
 
   # We need to enable queue to use generators.
   app.queue(api_open=False)
-  app.launch(debug=True, show_api=False)
+  app.show_api = False
+
+  # The app is served by a FastAPI server so that it can have other routes.
+  server = FastAPI()
+  server.add_api_route("/metrics", get_metrics, methods=["GET"])
+  gr.mount_gradio_app(server, app, path="/")
+  uvicorn.run(server,
+              host=os.getenv("GRADIO_SERVER_NAME", "127.0.0.1"),
+              port=int(os.getenv("GRADIO_SERVER_PORT", "7860")))
+  # uvicorn replaces the signal handlers of the scheduler and returns once it
+  # has shut down on SIGINT or SIGTERM, so the hooks are run here.
+  shutdown()
@@ -0,0 +1,238 @@
+"""
+It provides stand-ins for Firestore and the LLM providers, so that the hot
+paths can be measured offline without credentials.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import timezone
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+from firebase_admin import firestore
+import numpy as np
+
+DOCUMENT_ID = "__name__"
+
+
+class FakeSnapshot:
+
+  def __init__(self, doc_id: str, data: dict | None):
+    self.id = doc_id
+    self._data = data
+
+  @property
+  def exists(self) -> bool:
+    return self._data is not None
+
+  def to_dict(self) -> dict | None:
+    return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+
+  def __init__(self, client: "FakeFirestore", path: str, doc_id: str):
+    self._client = client
+    self.path = path
+    self.id = doc_id
+
+  def collection(self, name: str) -> "FakeCollection":
+    return FakeCollection(self._client, f"{self.path}/{self.id}/{name}")
+
+  def get(self) -> FakeSnapshot:
+    return FakeSnapshot(self.id, self._client.read(self.path, self.id))
+
+  def set(self, doc: dict, merge: bool = False):
+    self._client.write(self.path, self.id, doc, merge)
+
+
+# Supports the equality filters, ordering and cursors used by the app.
+class FakeQuery:
+
+  def __init__(self,
+               client: "FakeFirestore",
+               path: str,
+               filters: List[tuple] | None = None,
+               orders: List[str] | None = None,
+               start_after: dict | None = None,
+               fields: List[str] | None = None):
+    self._client = client
+    self._path = path
+    self._filters = filters or []
+    self._orders = orders or []
+    self._start_after = start_after
+    self._fields = fields
+
+  def where(self, filter) -> "FakeQuery":  # pylint: disable=redefined-builtin
+    if filter.op_string != "==":
+      raise NotImplementedError(f"Unsupported operator: {filter.op_string}")
+    return self._copy(filters=self._filters +
+                      [(filter.field_path, filter.value)])
+
+  def order_by(self, field_path: str) -> "FakeQuery":
+    return self._copy(orders=self._orders + [str(field_path)])
+
+  def start_after(self, values: dict) -> "FakeQuery":
+    return self._copy(start_after={
+        str(key): value for key, value in values.items()
+    })
+
+  def select(self, field_paths: List[str]) -> "FakeQuery":
+    return self._copy(fields=list(field_paths))
+
+  def stream(self):
+    docs = [(doc_id, data)
+            for doc_id, data in self._client.list(self._path)
+            if all(data.get(field) == value for field, value in self._filters)]
+    docs.sort(key=lambda item: self._get_order_key(*item))
+
+    if self._start_after is not None:
+      cursor = tuple(
+          self._get_cursor_value(self._start_after[field])
+          for field in self._orders)
+      docs = [item for item in docs if self._get_order_key(*item) > cursor]
+
+    for doc_id, data in docs:
+      if self._fields is not None:
+        data = {field: data[field] for field in self._fields if field in data}
+      yield FakeSnapshot(doc_id, data)
+
+  def _get_order_key(self, doc_id: str, data: dict) -> tuple:
+    return tuple(doc_id if field == DOCUMENT_ID else data.get(field)
+                 for field in self._orders)
+
+  def _get_cursor_value(self, value):
+    return value.id if isinstance(value, FakeDocument) else value
+
+  def _copy(self, **overrides) -> "FakeQuery":
+    return FakeQuery(self._client, self._path,
+                     overrides.get("filters", self._filters),
+                     overrides.get("orders", self._orders),
+                     overrides.get("start_after", self._start_after),
+                     overrides.get("fields", self._fields))
+
+
+class FakeCollection(FakeQuery):
+
+  def document(self, doc_id: str) -> FakeDocument:
+    return FakeDocument(self._client, self._path, doc_id)
+
+
+class FakeWriteBatch:
+
+  def __init__(self, client: "FakeFirestore"):
+    self._client = client
+    self._writes = []
+
+  def set(self, doc_ref: FakeDocument, doc: dict, merge: bool = False):
+    self._writes.append((doc_ref, doc, merge))
+
+  def commit(self):
+    for doc_ref, doc, merge in self._writes:
+      self._client.write(doc_ref.path, doc_ref.id, doc, merge)
+
+
+# An in-memory Firestore client. Documents are kept per collection path, and
+# server timestamps are resolved when they are written.
+class FakeFirestore:
+
+  def __init__(self):
+    self._collections: Dict[str, Dict[str, dict]] = {}
+    self._lock = threading.Lock()
+
+  def collection(self, name: str) -> FakeCollection:
+    return FakeCollection(self, name)
+
+  def batch(self) -> FakeWriteBatch:
+    return FakeWriteBatch(self)
+
+  def read(self, path: str, doc_id: str) -> dict | None:
+    with self._lock:
+      return self._collections.get(path, {}).get(doc_id)
+
+  def list(self, path: str):
+    with self._lock:
+      return list(self._collections.get(path, {}).items())
+
+  def write(self, path: str, doc_id: str, doc: dict, merge: bool = False):
+    now = datetime.now(timezone.utc)
+    data = {
+        key: now if value is firestore.SERVER_TIMESTAMP else value
+        for key, value in doc.items()
+    }
+    with self._lock:
+      docs = self._collections.setdefault(path, {})
+      if merge and doc_id in docs:
+        data = {**docs[doc_id], **data}
+      docs[doc_id] = data
+
+
+@dataclass
+class LatencyProfile:
+  # Time to the first token is log-normally distributed.
+  median_time_to_first_token: float = 0.2
+  time_to_first_token_sigma: float = 0.5
+  # Tokens per second of each response, normally distributed.
+  mean_tokens_per_second: float = 200.0
+  tokens_per_second_stddev: float = 50.0
+  output_tokens: int = 100
+
+
+# Returns a replacement of `litellm.completion` that sleeps like a provider
+# with the given latency profile and answers in the format each model asks
+# for.
+def create_fake_completion(profile: LatencyProfile, seed: int = 0):
+  rng = np.random.default_rng(seed)
+  lock = threading.Lock()
+
+  def completion(model: str,
+                 messages: List[dict],
+                 stream=False,
+                 stop: List[str] | None = None,
+                 stream_options: dict | None = None,
+                 **_):
+    with lock:
+      time_to_first_token = profile.median_time_to_first_token * float(
+          rng.lognormal(sigma=profile.time_to_first_token_sigma))
+      tokens_per_second = max(
+          float(
+              rng.normal(profile.mean_tokens_per_second,
+                         profile.tokens_per_second_stddev)), 1.0)
+
+    tokens = [f"{model} " for _ in range(profile.output_tokens)]
+    # Anthropic models are prefilled with the opening tag, and the closing tag
+    # is left out if it is a stop sequence.
+    if messages[-1]["role"] == "assistant":
+      if not stop:
+        tokens.append("</result>")
+    else:
+      tokens = ['{"result": "'] + tokens + ['"}']
+
+    prompt_tokens = sum(len(message["content"].split()) for message in messages)
+    usage = SimpleNamespace(prompt_tokens=prompt_tokens,
+                            completion_tokens=len(tokens))
+    if not stream:
+      time.sleep(time_to_first_token + len(tokens) / tokens_per_second)
+      message = SimpleNamespace(content="".join(tokens))
+      return SimpleNamespace(
+          choices=[SimpleNamespace(message=message, finish_reason="stop")],
+          usage=usage)
+
+    def generate():
+      time.sleep(time_to_first_token)
+      for index, token in enumerate(tokens):
+        time.sleep(1 / tokens_per_second)
+        finish_reason = "stop" if index == len(tokens) - 1 else None
+        yield SimpleNamespace(choices=[
+            SimpleNamespace(delta=SimpleNamespace(content=token),
+                            finish_reason=finish_reason)
+        ])
+      # Like OpenAI, the usage comes in a last chunk without choices.
+      if stream_options and stream_options.get("include_usage"):
+        yield SimpleNamespace(choices=[], usage=usage)
+
+    return generate()
+
+  return completion
@@ -0,0 +1,128 @@
+"""
+It simulates votes to compare how many of them each pair sampling strategy
+needs to rank the models correctly.
+
+The models have hidden Bradley-Terry strengths, and every vote is drawn from
+them. The ratings are refitted every `--refit-interval` votes, and the
+accuracy of a ranking is the fraction of model pairs it orders correctly.
+
+Run it from the repository root:
+  python -m benchmarks.pair_sampling --models 14 --runs 20
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from rating import fit_bradley_terry
+from rating import PairCounts
+from rating import WINNER_CODES
+from sampling import get_pair_weights
+from sampling import sample_pair
+
+TIE_PROBABILITY = 0.1
+
+
+def get_ranking_accuracy(models, strengths, ratings) -> float:
+  estimated = np.array([ratings.get(model, 0) for model in models])
+  upper = np.triu_indices(len(models), k=1)
+  true_order = np.sign(strengths[:, None] - strengths[None, :])[upper]
+  estimated_order = np.sign(estimated[:, None] - estimated[None, :])[upper]
+  return float((true_order == estimated_order).mean())
+
+
+# Returns the number of votes after which the ranking first reaches each of
+# the target accuracies, or None for the targets it never reaches.
+def simulate(num_models: int, targets, exploration: float | None,
+             max_votes: int, refit_interval: int, seed: int):
+  rng = np.random.default_rng(seed)
+  models = [f"model-{i}" for i in range(num_models)]
+  # Strengths of the leaderboard are typically within a few hundred points.
+  strengths = rng.normal(scale=0.5, size=num_models)
+
+  counts = PairCounts.empty()
+  # Adds every model to the counts so that the indices match `models`.
+  counts.add_arrays(models, np.arange(num_models, dtype=np.int32),
+                    np.roll(np.arange(num_models, dtype=np.int32), 1),
+                    np.full(num_models, WINNER_CODES["tie"], dtype=np.int8))
+  ratings = fit_bradley_terry(counts)
+
+  votes_needed = {target: None for target in targets}
+  for votes in range(refit_interval, max_votes + 1, refit_interval):
+    model_a = np.empty(refit_interval, dtype=np.int32)
+    model_b = np.empty(refit_interval, dtype=np.int32)
+    if exploration is None:
+      weights = np.ones((num_models, num_models))
+      np.fill_diagonal(weights, 0)
+      exploration_rate = 1.0
+    else:
+      weights = get_pair_weights(models, ratings, counts)
+      exploration_rate = exploration
+    for i in range(refit_interval):
+      model_a[i], model_b[i] = sample_pair(weights, exploration_rate, rng)
+
+    win_probability = 1 / (1 + np.exp(strengths[model_b] - strengths[model_a]))
+    draw = rng.random(refit_interval)
+    winner = np.where(
+        draw < TIE_PROBABILITY, WINNER_CODES["tie"],
+        np.where(
+            draw < TIE_PROBABILITY + (1 - TIE_PROBABILITY) * win_probability,
+            WINNER_CODES["model_a"], WINNER_CODES["model_b"])).astype(np.int8)
+    counts.add_arrays(models, model_a, model_b, winner)
+    ratings = fit_bradley_terry(counts)
+
+    accuracy = get_ranking_accuracy(models, strengths, ratings)
+    for target in targets:
+      if votes_needed[target] is None and accuracy >= target:
+        votes_needed[target] = votes
+    if all(value is not None for value in votes_needed.values()):
+      break
+
+  return votes_needed
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--models", type=int, default=14)
+  parser.add_argument("--runs", type=int, default=20)
+  parser.add_argument("--targets",
+                      type=float,
+                      nargs="+",
+                      default=[0.85, 0.9, 0.95])
+  parser.add_argument("--explorations",
+                      type=float,
+                      nargs="+",
+                      default=[0.1, 0.2, 0.5])
+  parser.add_argument("--max-votes", type=int, default=50000)
+  parser.add_argument("--refit-interval", type=int, default=50)
+  args = parser.parse_args()
+
+  strategies = [("uniform", None)]
+  for exploration in args.explorations:
+    strategies.append((f"adaptive (exploration={exploration})", exploration))
+
+  print(f"{args.runs} runs with {args.models} models. Median votes to reach "
+        "each ranking accuracy; runs that never reach it are not counted.")
+  print(f"{'strategy':<32}" +
+        "".join(f"{target:>10.0%}" for target in args.targets) +
+        f"{'time':>10}")
+  for name, exploration in strategies:
+    start = time.perf_counter()
+    results = [
+        simulate(args.models, args.targets, exploration, args.max_votes,
+                 args.refit_interval, seed) for seed in range(args.runs)
+    ]
+    elapsed = time.perf_counter() - start
+
+    row = f"{name:<32}"
+    for target in args.targets:
+      votes = [
+          result[target] for result in results if result[target] is not None
+      ]
+      row += f"{int(np.median(votes)):>10}" if votes else f"{'-':>10}"
+    print(row + f"{elapsed:>9.1f}s")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,72 @@
+"""
+It measures the throughput of `check_rate_limit` with many active tokens
+under contention.
+
+Run it from the repository root:
+  python -m benchmarks.rate_limit --tokens 1000000 --threads 8
+
+With `--backend sqlite`, the database at RATE_LIMIT_DB_PATH is used.
+"""
+
+import argparse
+from concurrent import futures
+import random
+import time
+from uuid import uuid4
+
+from rate_limit import create_backend
+from rate_limit import RateLimiter
+from rate_limit import SystemRateLimitException
+from rate_limit import UserRateLimitException
+
+
+def run_worker(limiter: RateLimiter, tokens, calls: int, seed: int):
+  rng = random.Random(seed)
+  rejected = 0
+  for _ in range(calls):
+    try:
+      limiter.check_rate_limit(tokens[rng.randrange(len(tokens))])
+    except (UserRateLimitException, SystemRateLimitException):
+      rejected += 1
+  return rejected
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--tokens", type=int, default=1_000_000)
+  parser.add_argument("--threads", type=int, default=8)
+  parser.add_argument("--calls-per-thread", type=int, default=100_000)
+  parser.add_argument("--limit",
+                      type=int,
+                      default=10000,
+                      help="System-wide limit of requests per day.")
+  parser.add_argument("--backend",
+                      choices=["memory", "sqlite"],
+                      default="memory")
+  args = parser.parse_args()
+
+  limiter = RateLimiter(create_backend(args.backend), limit=args.limit)
+  tokens = [uuid4().hex for _ in range(args.tokens)]
+
+  start = time.perf_counter()
+  for token in tokens:
+    limiter.initialize_request(token)
+  print(f"Initialized {args.tokens} tokens in "
+        f"{time.perf_counter() - start:.2f}s.")
+
+  with futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
+    start = time.perf_counter()
+    tasks = [
+        executor.submit(run_worker, limiter, tokens, args.calls_per_thread,
+                        seed) for seed in range(args.threads)
+    ]
+    rejected = sum(task.result() for task in tasks)
+    elapsed = time.perf_counter() - start
+
+  calls = args.threads * args.calls_per_thread
+  print(f"{calls} calls from {args.threads} threads in {elapsed:.2f}s: "
+        f"{calls / elapsed:,.0f} calls/s, {rejected} rejected.")
+
+
+if __name__ == "__main__":
+  main()
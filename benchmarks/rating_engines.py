@@ -0,0 +1,113 @@
+"""
+It compares the runtime and memory of the rating engines on synthetic battles.
+
+Run it from the repository root:
+  python -m benchmarks.rating_engines --sizes 100000 1000000 10000000
+"""
+
+import argparse
+from dataclasses import dataclass
+import time
+import tracemalloc
+
+import numpy as np
+
+from rating import fit_bradley_terry
+from rating import PairCounts
+from rating import update_elo
+from rating import WINNER_CODES
+
+NUM_MODELS = 14
+
+
+@dataclass
+class SyntheticBattle:
+  model_a: str
+  model_b: str
+  winner: str
+
+
+# Returns battle arrays sampled from a Bradley-Terry model with random
+# strengths.
+def generate_battles(size: int, seed: int = 0):
+  rng = np.random.default_rng(seed)
+  models = [f"model-{i}" for i in range(NUM_MODELS)]
+  strengths = rng.normal(scale=0.5, size=NUM_MODELS)
+
+  model_a = rng.integers(0, NUM_MODELS, size=size, dtype=np.int32)
+  offset = rng.integers(1, NUM_MODELS, size=size, dtype=np.int32)
+  model_b = (model_a + offset) % NUM_MODELS
+
+  win_probability = 1 / (1 + np.exp(strengths[model_b] - strengths[model_a]))
+  draw = rng.random(size)
+  winner = np.where(
+      draw < 0.1, WINNER_CODES["tie"],
+      np.where(draw < 0.1 + 0.9 * win_probability, WINNER_CODES["model_a"],
+               WINNER_CODES["model_b"])).astype(np.int8)
+  return models, model_a, model_b, winner
+
+
+def to_battle_objects(models, model_a, model_b, winner):
+  winner_names = {code: name for name, code in WINNER_CODES.items()}
+  return [
+      SyntheticBattle(models[a], models[b], winner_names[w])
+      for a, b, w in zip(model_a.tolist(), model_b.tolist(), winner.tolist())
+  ]
+
+
+def run_elo(battles):
+  update_elo({}, battles)
+
+
+def run_bradley_terry(models, model_a, model_b, winner):
+  counts = PairCounts.empty()
+  counts.add_arrays(models, model_a, model_b, winner)
+  fit_bradley_terry(counts)
+
+
+# Returns (seconds, peak traced memory in bytes). The memory is measured in a
+# separate run because tracing slows down the pure-Python loop.
+def measure(fn, *args):
+  start = time.perf_counter()
+  fn(*args)
+  elapsed = time.perf_counter() - start
+
+  tracemalloc.start()
+  fn(*args)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return elapsed, peak
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--sizes",
+                      type=int,
+                      nargs="+",
+                      default=[100_000, 1_000_000, 10_000_000])
+  args = parser.parse_args()
+
+  print(f"{'battles':>10} {'engine':>14} {'seconds':>9} {'peak MiB':>9} "
+        f"{'input MiB':>9}")
+  for size in args.sizes:
+    arrays = generate_battles(size)
+    array_bytes = sum(array.nbytes for array in arrays[1:])
+
+    tracemalloc.start()
+    battles = to_battle_objects(*arrays)
+    object_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for engine, fn, fn_args, input_bytes in (
+        ("elo", run_elo, (battles,), object_bytes),
+        ("bradley_terry", run_bradley_terry, arrays, array_bytes),
+    ):
+      elapsed, peak = measure(fn, *fn_args)
+      print(f"{size:>10} {engine:>14} {elapsed:>9.3f} {peak / 2**20:>9.1f} "
+            f"{input_bytes / 2**20:>9.1f}")
+
+    del battles
+
+
+if __name__ == "__main__":
+  main()
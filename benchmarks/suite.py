@@ -0,0 +1,263 @@
+"""
+It measures the latency of the hot paths offline. `litellm.completion` is
+replaced with a fake provider and Firestore with an in-memory stand-in, so
+neither LLM keys nor a Firestore project is needed.
+
+Run it from the repository root:
+  python -m benchmarks.suite --output benchmark.json
+
+With `--baseline`, the results are compared with a previous output, and the
+run fails if the median of any operation regressed by more than
+`--tolerance`.
+"""
+
+import argparse
+from concurrent import futures
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+import json
+import os
+import platform
+import sys
+import time
+from uuid import uuid4
+
+import numpy as np
+
+from benchmarks.fakes import create_fake_completion
+from benchmarks.fakes import FakeFirestore
+from benchmarks.fakes import LatencyProfile
+from benchmarks.rating_engines import generate_battles
+from benchmarks.rating_engines import to_battle_objects
+
+SUMMARIZATIONS_COLLECTION = "arena-summarizations"
+TRANSLATIONS_COLLECTION = "arena-translations"
+
+PROMPT = "The quick brown fox jumps over the lazy dog. " * 20
+
+
+# Replaces Firebase and litellm before the app modules are imported, since
+# `db` initializes Firebase at import.
+def install_fakes(fake_db: FakeFirestore, profile: LatencyProfile):
+  # The battles are seeded into the fake Firestore.
+  os.environ["STORAGE_BACKEND"] = "firestore"
+  os.environ.setdefault("CREDENTIALS", "{}")
+  os.environ.setdefault("RATINGS_COLLECTION", "arena-ratings")
+  os.environ.setdefault("SUMMARIZATIONS_COLLECTION", SUMMARIZATIONS_COLLECTION)
+  os.environ.setdefault("TRANSLATIONS_COLLECTION", TRANSLATIONS_COLLECTION)
+  # Cache hits would hide the provider latency.
+  os.environ.setdefault("COMPLETION_CACHE_SIZE", "0")
+
+  # pylint: disable=import-outside-toplevel
+  import firebase_admin
+  from firebase_admin import credentials
+  from firebase_admin import firestore
+  import litellm
+
+  firebase_admin.initialize_app = lambda *args, **kwargs: None
+  credentials.Certificate = lambda *args, **kwargs: None
+  firestore.client = lambda *args, **kwargs: fake_db
+  litellm.completion = create_fake_completion(profile)
+
+
+def summarize(latencies) -> dict:
+  latencies = np.array(latencies)
+  p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+  return {
+      "count": len(latencies),
+      "mean": float(latencies.mean()),
+      "p50": float(p50),
+      "p95": float(p95),
+      "p99": float(p99),
+  }
+
+
+# Calls `fn` with each of `args` from `concurrency` threads and returns the
+# latency of each call.
+def measure(fn, args, concurrency: int = 1):
+
+  def timed_call(arg):
+    start = time.perf_counter()
+    fn(*arg)
+    return time.perf_counter() - start
+
+  with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+    return list(executor.map(timed_call, args))
+
+
+# Writes synthetic summarization battles to the fake Firestore.
+def seed_battles(fake_db: FakeFirestore, size: int, start: datetime):
+  models, model_a, model_b, winner = generate_battles(size)
+  collection = fake_db.collection(SUMMARIZATIONS_COLLECTION)
+  for index, battle in enumerate(
+      to_battle_objects(models, model_a, model_b, winner)):
+    collection.document(uuid4().hex).set({
+        "model_a": battle.model_a,
+        "model_b": battle.model_b,
+        "winner": battle.winner,
+        "model_a_response_language": "english",
+        "model_b_response_language": "english",
+        "timestamp": start + timedelta(microseconds=index),
+    })
+
+
+def benchmark_get_responses(response, rate_limiter, iterations: int,
+                            concurrency: int):
+
+  def run(category: str, source_lang: str, target_lang: str):
+    token = uuid4().hex
+    rate_limiter.initialize_request(token)
+    for _ in response.get_responses(PROMPT, category, source_lang, target_lang,
+                                    token):
+      pass
+
+  categories = [
+      (response.Category.SUMMARIZE.value, "", ""),
+      (response.Category.TRANSLATE.value, "English", "Korean"),
+  ]
+  return measure(run, [categories[i % 2] for i in range(iterations)],
+                 concurrency)
+
+
+def benchmark_vote(app, iterations: int):
+  votes = [option.value for option in app.VoteOptions]
+  categories = [category.value for category in app.response.Category]
+  args = [(votes[i % len(votes)], PROMPT, PROMPT, "model-a", "model-b", PROMPT,
+           "instruction", categories[i % len(categories)], "English", "Korean",
+           uuid4().hex) for i in range(iterations)]
+  return measure(app.vote, args)
+
+
+def benchmark_load_elo_ratings(fake_db: FakeFirestore, leaderboard,
+                               iterations: int, new_battles: int):
+  tab = leaderboard.LeaderboardTab.SUMMARIZATION
+  any_language = leaderboard.ANY_LANGUAGE
+
+  full = measure(
+      lambda: leaderboard.load_elo_ratings(
+          tab, any_language, None, full_rebuild=True), [()] * iterations)
+
+  # Each load folds in the battles added since the previous one.
+  incremental = []
+  for _ in range(iterations):
+    seed_battles(fake_db, new_battles, datetime.now(timezone.utc))
+    incremental += measure(
+        lambda: leaderboard.load_elo_ratings(tab, any_language, None), [()])
+  return full, incremental
+
+
+def benchmark_check_rate_limit(rate_limiter, iterations: int):
+  tokens = [uuid4().hex for _ in range(iterations)]
+  for token in tokens:
+    rate_limiter.initialize_request(token)
+  return measure(rate_limiter.check_rate_limit, [(token,) for token in tokens])
+
+
+def benchmark_compute_elo(compute_elo, sizes):
+  results = {}
+  for size in sizes:
+    battles = to_battle_objects(*generate_battles(size))
+    start = time.perf_counter()
+    compute_elo(battles)
+    results[str(size)] = time.perf_counter() - start
+    print(f"compute_elo with {size} battles: {results[str(size)]:.3f}s")
+    del battles
+  return results
+
+
+# Returns the operations whose median got slower than the baseline by more
+# than `tolerance`.
+def find_regressions(results: dict, baseline: dict, tolerance: float):
+  regressions = []
+  for name, stats in results["operations"].items():
+    baseline_stats = baseline["operations"].get(name)
+    if baseline_stats is None:
+      continue
+
+    if stats["p50"] > baseline_stats["p50"] * (1 + tolerance):
+      regressions.append((name, baseline_stats["p50"], stats["p50"]))
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--iterations", type=int, default=50)
+  parser.add_argument("--concurrency", type=int, default=4)
+  parser.add_argument("--battles", type=int, default=100_000)
+  parser.add_argument("--new-battles-per-load", type=int, default=100)
+  parser.add_argument("--elo-sizes",
+                      type=int,
+                      nargs="+",
+                      default=[1000, 10_000, 100_000, 1_000_000, 10_000_000])
+  parser.add_argument("--median-time-to-first-token", type=float, default=0.2)
+  parser.add_argument("--time-to-first-token-sigma", type=float, default=0.5)
+  parser.add_argument("--mean-tokens-per-second", type=float, default=200.0)
+  parser.add_argument("--tokens-per-second-stddev", type=float, default=50.0)
+  parser.add_argument("--output-tokens", type=int, default=100)
+  parser.add_argument("--output", default="benchmark.json")
+  parser.add_argument("--baseline")
+  parser.add_argument("--tolerance", type=float, default=0.2)
+  args = parser.parse_args()
+
+  fake_db = FakeFirestore()
+  install_fakes(
+      fake_db,
+      LatencyProfile(args.median_time_to_first_token,
+                     args.time_to_first_token_sigma,
+                     args.mean_tokens_per_second, args.tokens_per_second_stddev,
+                     args.output_tokens))
+
+  # pylint: disable=import-outside-toplevel
+  import app
+  import db
+  import leaderboard
+  from rate_limit import rate_limiter
+  import rating
+  import response
+
+  # Builds the language detector before the votes are timed.
+  app.detector.detect_language_of(PROMPT)
+  seed_battles(fake_db, args.battles, datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+  operations = {}
+  operations["get_responses"] = summarize(
+      benchmark_get_responses(response, rate_limiter, args.iterations,
+                              args.concurrency))
+  operations["vote"] = summarize(benchmark_vote(app, args.iterations))
+  full, incremental = benchmark_load_elo_ratings(fake_db, leaderboard,
+                                                 args.iterations,
+                                                 args.new_battles_per_load)
+  operations["load_elo_ratings_full"] = summarize(full)
+  operations["load_elo_ratings_incremental"] = summarize(incremental)
+  operations["check_rate_limit"] = summarize(
+      benchmark_check_rate_limit(rate_limiter, args.iterations * 100))
+  db.storage.close()
+
+  for name, stats in operations.items():
+    print(f"{name:<32} p50 {stats['p50'] * 1000:9.2f}ms "
+          f"p95 {stats['p95'] * 1000:9.2f}ms p99 {stats['p99'] * 1000:9.2f}ms")
+
+  results = {
+      "python": platform.python_version(),
+      "config": vars(args),
+      "operations": operations,
+      "compute_elo": benchmark_compute_elo(rating.compute_elo, args.elo_sizes),
+  }
+  with open(args.output, "w", encoding="utf-8") as output_file:
+    json.dump(results, output_file, indent=2)
+  print(f"Results are written to {args.output}.")
+
+  if args.baseline:
+    with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+      regressions = find_regressions(results, json.load(baseline_file),
+                                     args.tolerance)
+    for name, baseline_p50, p50 in regressions:
+      print(f"Regression in {name}: p50 {baseline_p50 * 1000:.2f}ms -> "
+            f"{p50 * 1000:.2f}ms")
+    if regressions:
+      sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,162 @@
+"""
+This module caches completion results, so that identical requests do not
+pay for another provider call.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from scheduler import scheduler
+from sqlite_connection import ThreadLocalConnection
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# The maximum number of results kept in memory. Set it to 0 to disable the
+# cache.
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", "1024"))
+# Results older than this many seconds are not used.
+COMPLETION_CACHE_TTL = int(os.getenv("COMPLETION_CACHE_TTL", "86400"))
+# If set, results are also kept in a SQLite database at this path, so that
+# they survive restarts.
+COMPLETION_CACHE_PATH = os.getenv("COMPLETION_CACHE_PATH")
+
+
+@dataclass
+class CacheEntry:
+  result: str
+  created_at: float
+  # What the provider call that produced the result took, which is saved by
+  # every hit.
+  latency: float
+  cost: float
+
+
+def get_cache_key(model_name: str, instruction: str, prompt: str,
+                  max_tokens: int | None) -> str:
+  return hashlib.sha256(
+      json.dumps([model_name, instruction, prompt,
+                  max_tokens]).encode()).hexdigest()
+
+
+class CompletionCache:
+
+  def __init__(self, max_size: int, ttl: float, path: str | None = None):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.path = path
+
+    self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+    self._lock = threading.Lock()
+    self._connection = ThreadLocalConnection(path) if path else None
+
+    self.hits = 0
+    self.misses = 0
+    self.saved_seconds = 0.0
+    self.saved_cost = 0.0
+
+    if self.path:
+      self._connection.get().executescript("""
+        CREATE TABLE IF NOT EXISTS completions (
+          key TEXT PRIMARY KEY,
+          result TEXT NOT NULL,
+          created_at REAL NOT NULL,
+          latency REAL NOT NULL,
+          cost REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS completions_created_at
+          ON completions (created_at);
+      """)
+
+  @property
+  def enabled(self) -> bool:
+    return self.max_size > 0
+
+  def get(self, key: str) -> str | None:
+    entry = self._get_entry(key)
+
+    with self._lock:
+      if entry is None:
+        self.misses += 1
+        return None
+
+      self.hits += 1
+      self.saved_seconds += entry.latency
+      self.saved_cost += entry.cost
+      return entry.result
+
+  def put(self, key: str, result: str, latency: float, cost: float):
+    entry = CacheEntry(result, time.time(), latency, cost)
+    self._put_in_memory(key, entry)
+
+    if self.path:
+      connection = self._connection.get()
+      connection.execute(
+          "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+          (key, entry.result, entry.created_at, entry.latency, entry.cost))
+      connection.execute("DELETE FROM completions WHERE created_at < ?",
+                         (entry.created_at - self.ttl,))
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+          "hits": self.hits,
+          "misses": self.misses,
+          "saved_seconds": self.saved_seconds,
+          "saved_cost": self.saved_cost,
+          "size": len(self._entries),
+      }
+
+  def _get_entry(self, key: str) -> CacheEntry | None:
+    now = time.time()
+
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        if now - entry.created_at < self.ttl:
+          self._entries.move_to_end(key)
+          return entry
+        del self._entries[key]
+
+    if not self.path:
+      return None
+
+    row = self._connection.get().execute(
+        "SELECT result, created_at, latency, cost FROM completions "
+        "WHERE key = ? AND created_at >= ?", (key, now - self.ttl)).fetchone()
+    if row is None:
+      return None
+
+    entry = CacheEntry(*row)
+    self._put_in_memory(key, entry)
+    return entry
+
+  def _put_in_memory(self, key: str, entry: CacheEntry):
+    with self._lock:
+      self._entries[key] = entry
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+
+completion_cache = CompletionCache(COMPLETION_CACHE_SIZE, COMPLETION_CACHE_TTL,
+                                   COMPLETION_CACHE_PATH)
+
+
+def log_cache_stats():
+  stats = completion_cache.stats()
+  logger.info(
+      "Completion cache: %d hits, %d misses, saved %.1fs of provider "
+      "latency and $%.4f.", stats["hits"], stats["misses"],
+      stats["saved_seconds"], stats["saved_cost"])
+
+
+if completion_cache.enabled:
+  scheduler.add_job(log_cache_stats, "interval", seconds=60 * 60)
@@ -0,0 +1,160 @@
+"""
+This module splits long texts into chunks and summarizes them in map-reduce
+fashion, so that documents longer than a single request can be summarized.
+"""
+
+from concurrent import futures
+from dataclasses import dataclass
+import math
+import os
+import re
+from typing import Callable, List, Tuple
+
+from metrics import CompletionStats
+from model import count_tokens
+from model import Model
+import tracing
+
+# Summarize prompts with more tokens than this are summarized in chunks of at
+# most CHUNK_TOKENS tokens, which fit the context window of every model.
+CHUNKING_THRESHOLD = int(os.getenv("CHUNKING_THRESHOLD", "6000"))
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "3000"))
+# The max_tokens of the summary of each chunk.
+CHUNK_SUMMARY_TOKENS = int(os.getenv("CHUNK_SUMMARY_TOKENS", "512"))
+
+REDUCE_INSTRUCTION = "The given text consists of the summaries of consecutive parts of a document. Combine them into a single summary of the document without changing the language of it."  # pylint: disable=line-too-long
+
+# Texts are split on paragraphs first, and on sentences if a paragraph does
+# not fit in a chunk.
+PARAGRAPH_BOUNDARY = re.compile(r"\n\s*\n")
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?。！？])\s+")
+
+# Separate from the executor of the battles, which waits on these tasks.
+chunk_executor = futures.ThreadPoolExecutor(max_workers=32)
+
+
+@dataclass
+class ChunkPlan:
+  chunks: List[str]
+  # The [start, end) character offsets of each chunk in the text.
+  spans: List[Tuple[int, int]]
+  token_counts: List[int]
+
+  # Spans are stored as maps, since Firestore does not allow nested arrays.
+  def to_dict(self) -> dict:
+    return {
+        "chunk_tokens": CHUNK_TOKENS,
+        "spans": [{
+            "start": start,
+            "end": end
+        } for start, end in self.spans],
+        "token_counts": self.token_counts,
+    }
+
+
+def should_chunk(prompt_tokens: int) -> bool:
+  return prompt_tokens > CHUNKING_THRESHOLD
+
+
+# Returns the spans of the pieces of text[start:end] that end with a match of
+# `pattern`, except the last one.
+def _split_spans(text: str, start: int, end: int,
+                 pattern: re.Pattern) -> List[Tuple[int, int]]:
+  spans = []
+  piece_start = start
+  for match in pattern.finditer(text, start, end):
+    spans.append((piece_start, match.end()))
+    piece_start = match.end()
+  if piece_start < end:
+    spans.append((piece_start, end))
+  return spans
+
+
+# Returns (start, end, tokens) of the pieces of text[start:end], split on the
+# first of `patterns` that makes them fit in `max_tokens`. A piece with no
+# boundary left is split evenly by characters.
+def _get_units(text: str, start: int, end: int, max_tokens: int,
+               patterns: List[re.Pattern]) -> List[Tuple[int, int, int]]:
+  tokens = count_tokens(text[start:end])
+  if tokens <= max_tokens:
+    return [(start, end, tokens)]
+
+  if not patterns:
+    size = math.ceil((end - start) / math.ceil(tokens / max_tokens))
+    return [(piece_start, min(piece_start + size, end),
+             count_tokens(text[piece_start:piece_start + size]))
+            for piece_start in range(start, end, size)]
+
+  units = []
+  for piece_start, piece_end in _split_spans(text, start, end, patterns[0]):
+    units += _get_units(text, piece_start, piece_end, max_tokens, patterns[1:])
+  return units
+
+
+# Packs the paragraphs and sentences of the text into as few chunks of at most
+# `max_tokens` tokens as possible, keeping their order.
+def create_chunk_plan(text: str, max_tokens: int = CHUNK_TOKENS) -> ChunkPlan:
+  spans = []
+  token_counts = []
+  for start, end, tokens in _get_units(text, 0, len(text), max_tokens,
+                                       [PARAGRAPH_BOUNDARY, SENTENCE_BOUNDARY]):
+    if spans and token_counts[-1] + tokens <= max_tokens:
+      spans[-1] = (spans[-1][0], end)
+      token_counts[-1] += tokens
+    else:
+      spans.append((start, end))
+      token_counts.append(tokens)
+
+  return ChunkPlan([text[start:end] for start, end in spans], spans,
+                   token_counts)
+
+
+# Summarizes the chunks concurrently with the model, and then the joined
+# summaries of them, in chunks again while they do not fit in one. Only the
+# final summary is streamed to `on_partial`, and it is valid only if every
+# response was. The usage of every request is added to `stats`.
+def summarize_in_chunks(
+    model: Model,
+    instruction: str,
+    plan: ChunkPlan,
+    max_tokens: int | None = None,
+    on_partial: Callable[[str], None] | None = None,
+    deadline: float | None = None,
+    stats: CompletionStats | None = None) -> Tuple[str, bool]:
+
+  def summarize(chunk_instruction: str,
+                chunks: List[str]) -> List[Tuple[str, bool]]:
+    tasks = [
+        chunk_executor.submit(tracing.bind(model.completion),
+                              chunk_instruction,
+                              chunk,
+                              max_tokens=CHUNK_SUMMARY_TOKENS,
+                              deadline=deadline,
+                              stats=stats) for chunk in chunks
+    ]
+    return [task.result() for task in tasks]
+
+  results = summarize(instruction, plan.chunks)
+  is_valid = all(is_valid_result for _, is_valid_result in results)
+  summaries = "\n\n".join(result for result, _ in results)
+
+  num_chunks = len(plan.chunks)
+  while count_tokens(summaries) > CHUNK_TOKENS:
+    chunks = create_chunk_plan(summaries).chunks
+    # Stops if the summaries no longer get shorter.
+    if len(chunks) >= num_chunks:
+      break
+
+    results = summarize(REDUCE_INSTRUCTION, chunks)
+    is_valid = is_valid and all(
+        is_valid_result for _, is_valid_result in results)
+    summaries = "\n\n".join(result for result, _ in results)
+    num_chunks = len(chunks)
+
+  summary, is_valid_summary = model.completion(REDUCE_INSTRUCTION,
+                                               summaries,
+                                               max_tokens=max_tokens,
+                                               on_partial=on_partial,
+                                               deadline=deadline,
+                                               stats=stats)
+  return summary, is_valid and is_valid_summary
@@ -1,18 +1,51 @@
 """
 This module handles the management of the database.
+
+Battles, history and ratings are kept in one of the storage backends:
+1. Firestore (default): Requires the Firebase credentials and the collection
+   names in the environment variables.
+
+2. SQLite: Keeps everything in a local database file with indexes on the
+   category, languages and timestamp of the battles. It suits self-hosted
+   deployments and local load tests. Like Firestore, it only loads the rows
+   of the battles, and the ratings are computed from them in Python.
 """
+from abc import ABC
+from abc import abstractmethod
+import array
 from dataclasses import dataclass
+from datetime import datetime
+from datetime import timezone
 import enum
+import json
+import logging
 import os
-from typing import List
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+from uuid import uuid4
 
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import firestore
+from google.api_core import exceptions as google_exceptions
 from google.cloud.firestore_v1 import base_query
+from google.cloud.firestore_v1 import document
+from google.cloud.firestore_v1.field_path import FieldPath
 import gradio as gr
+import numpy as np
 
 from credentials import get_credentials_json
+from metrics import add_gauge
+from rating import WINNER_CODES
+from scheduler import add_shutdown_hook
+from sqlite_connection import ThreadLocalConnection
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
 
 def get_required_env(name: str) -> str:
@@ -22,13 +55,15 @@ def get_required_env(name: str) -> str:
   return value
 
 
-RATINGS_COLLECTION = get_required_env("RATINGS_COLLECTION")
-SUMMARIZATIONS_COLLECTION = get_required_env("SUMMARIZATIONS_COLLECTION")
-TRANSLATIONS_COLLECTION = get_required_env("TRANSLATIONS_COLLECTION")
+# "firestore" or "sqlite".
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+STORAGE_DB_PATH = os.getenv("STORAGE_DB_PATH", "arena.db")
 
-if gr.NO_RELOAD:
-  firebase_admin.initialize_app(credentials.Certificate(get_credentials_json()))
-  db = firestore.client()
+# Subcollection of each ratings document that stores the rating state
+# needed to fold in new battles without replaying the whole history.
+CHECKPOINTS_COLLECTION = "checkpoints"
+SUMMARIZATION_HISTORY_COLLECTION = "arena-summarization-history"
+TRANSLATION_HISTORY_COLLECTION = "arena-translation-history"
 
 
 class Category(enum.Enum):
@@ -42,73 +77,751 @@ class Rating:
   rating: int
 
 
-def get_ratings(category: Category, source_lang: str | None,
-                target_lang: str | None) -> List[Rating] | None:
-  doc_id = "#".join([category.value] +
-                    [lang for lang in (source_lang, target_lang) if lang])
-  # TODO(#37): Make it more clear what fields are in the document.
-  doc_dict = db.collection(RATINGS_COLLECTION).document(doc_id).get().to_dict()
-  if doc_dict is None:
-    return None
+@dataclass
+class RatingCheckpoint:
+  # Unrounded ratings, so that folding in new battles does not accumulate
+  # rounding errors.
+  ratings: Dict[str, float]
+  # Maps each model to the number of wins against each opponent.
+  wins: Dict[str, Dict[str, int]]
+  # Maps each model to the number of ties with each opponent.
+  ties: Dict[str, Dict[str, int]]
+  # The last battle folded into the ratings.
+  last_timestamp: datetime
+  last_battle_id: str
 
-  # TODO(#37): Return the timestamp as well.
-  doc_dict.pop("timestamp")
 
-  return [Rating(model, rating) for model, rating in doc_dict.items()]
+@dataclass
+class Battle:
+  model_a: str
+  model_b: str
+  winner: str
+  id: str | None = None
+  timestamp: datetime | None = None
 
 
-def set_ratings(category: Category, ratings: List[Rating], source_lang: str,
-                target_lang: str | None):
+# The fields of the battles that the rating engines need.
+BATTLE_COLUMN_FIELDS = ["model_a", "model_b", "winner", "timestamp"]
+# The fields that the battles are filtered by on the leaderboard.
+BATTLE_LANGUAGE_FIELDS = {
+    Category.SUMMARIZATION: [
+        "model_a_response_language", "model_b_response_language"
+    ],
+    Category.TRANSLATION: ["source_language", "target_language"],
+}
+
+
+# Battles stored as columns, which take a small fraction of the memory of
+# Battle objects. Model names are interned, so that model_a and model_b are
+# indices into `models`.
+@dataclass
+class BattleColumns:
+  models: List[str]
+  model_a: np.ndarray
+  model_b: np.ndarray
+  # Values of rating.WINNER_CODES.
+  winner: np.ndarray
+  # Microseconds since the epoch.
+  timestamps: np.ndarray
+  # The ID of the last battle, which is needed to resume after it.
+  last_battle_id: str | None
+  # If loaded with languages, the source and target language of each battle
+  # as indices into `languages`, or -1 if it has none. The source language of
+  # a summarization is the language of both responses, or none if they
+  # differ.
+  languages: List[str] | None = None
+  source_language: np.ndarray | None = None
+  target_language: np.ndarray | None = None
+
+  # Builds the columns from (model A, model B, winner, timestamp in
+  # microseconds, battle ID, source language, target language) tuples.
+  @classmethod
+  def from_rows(cls,
+                rows: Iterable[Tuple[str, str, str, int, str, str | None,
+                                     str | None]],
+                with_languages: bool = False) -> "BattleColumns":
+    indices: Dict[str, int] = {}
+    model_a = array.array("i")
+    model_b = array.array("i")
+    winner = array.array("b")
+    timestamps = array.array("q")
+    last_battle_id = None
+
+    language_indices: Dict[str, int] = {}
+    source_language = array.array("h")
+    target_language = array.array("h")
+
+    def get_language_index(language: str | None) -> int:
+      if not language:
+        return -1
+      return language_indices.setdefault(language, len(language_indices))
+
+    for (name_a, name_b, winner_name, timestamp, battle_id, source_lang,
+         target_lang) in rows:
+      model_a.append(indices.setdefault(name_a, len(indices)))
+      model_b.append(indices.setdefault(name_b, len(indices)))
+      winner.append(WINNER_CODES[winner_name])
+      timestamps.append(timestamp)
+      last_battle_id = battle_id
+
+      if with_languages:
+        source_language.append(get_language_index(source_lang))
+        target_language.append(get_language_index(target_lang))
+
+    columns = cls(list(indices), np.frombuffer(model_a, dtype=np.int32),
+                  np.frombuffer(model_b, dtype=np.int32),
+                  np.frombuffer(winner, dtype=np.int8),
+                  np.frombuffer(timestamps, dtype=np.int64), last_battle_id)
+    if with_languages:
+      columns.languages = list(language_indices)
+      columns.source_language = np.frombuffer(source_language, dtype=np.int16)
+      columns.target_language = np.frombuffer(target_language, dtype=np.int16)
+    return columns
+
+  # Returns the battles at the given indices, keeping their order. Only the
+  # models that take part in them are kept.
+  def take(self, indices: np.ndarray) -> "BattleColumns":
+    model_a = self.model_a[indices]
+    model_b = self.model_b[indices]
+    used_models = np.union1d(model_a, model_b)
+    new_indices = np.full(len(self.models), -1, dtype=np.int32)
+    new_indices[used_models] = np.arange(len(used_models), dtype=np.int32)
+
+    return BattleColumns([self.models[index] for index in used_models.tolist()],
+                         new_indices[model_a], new_indices[model_b],
+                         self.winner[indices], self.timestamps[indices], None)
+
+  def __len__(self) -> int:
+    return len(self.winner)
+
+  @property
+  def last_timestamp(self) -> datetime | None:
+    if not self:
+      return None
+    return _from_microseconds(int(self.timestamps[-1]))
+
+
+def _get_ratings_doc_id(category: Category, source_lang: str,
+                        target_lang: str | None) -> str:
   source_lang_lowercase = source_lang.lower()
   target_lang_lowercase = target_lang.lower() if target_lang else None
 
-  doc_id = "#".join([category.value, source_lang_lowercase] +
-                    ([target_lang_lowercase] if target_lang_lowercase else []))
-  doc_ref = db.collection(RATINGS_COLLECTION).document(doc_id)
+  return "#".join([category.value, source_lang_lowercase] +
+                  ([target_lang_lowercase] if target_lang_lowercase else []))
 
-  new_ratings = {rating.model: rating.rating for rating in ratings}
-  new_ratings["timestamp"] = firestore.SERVER_TIMESTAMP
-  doc_ref.set(new_ratings, merge=True)
 
+class Storage(ABC):
 
-@dataclass
-class Battle:
-  model_a: str
-  model_b: str
-  winner: str
+  @abstractmethod
+  def get_ratings(self, category: Category, source_lang: str,
+                  target_lang: str | None) -> List[Rating] | None:
+    pass
 
+  @abstractmethod
+  def set_ratings(self, category: Category, ratings: List[Rating],
+                  source_lang: str, target_lang: str | None):
+    pass
 
-def get_battles(category: Category, source_lang: str | None,
-                target_lang: str | None) -> List[Battle]:
-  source_lang_lowercase = source_lang.lower() if source_lang else None
-  target_lang_lowercase = target_lang.lower() if target_lang else None
+  @abstractmethod
+  def get_rating_checkpoint(self, category: Category, engine: str,
+                            source_lang: str,
+                            target_lang: str | None) -> RatingCheckpoint | None:
+    pass
+
+  @abstractmethod
+  def set_rating_checkpoint(self, category: Category, engine: str,
+                            checkpoint: RatingCheckpoint, source_lang: str,
+                            target_lang: str | None):
+    pass
+
+  # Returns the battles in the order of (timestamp, battle ID). If `after` is
+  # given as (timestamp, battle ID), only the battles that come after it are
+  # returned. Only their fields in BATTLE_COLUMN_FIELDS are fetched, and those
+  # in BATTLE_LANGUAGE_FIELDS if `with_languages` is set.
+  @abstractmethod
+  def get_battle_columns(self,
+                         category: Category,
+                         source_lang: str | None,
+                         target_lang: str | None,
+                         after: Tuple[datetime, str] | None = None,
+                         with_languages: bool = False) -> BattleColumns:
+    pass
+
+  # Stores a vote. `doc` holds the fields of the battle except its ID and
+  # timestamp, which are set by the storage.
+  @abstractmethod
+  def add_battle(self, category: Category, doc: dict):
+    pass
+
+  # Stores a response shown to a user. `doc` holds the fields except the ID
+  # and timestamp, as in `add_battle`.
+  @abstractmethod
+  def add_history(self, category: Category, doc: dict):
+    pass
+
+  # Flushes pending writes.
+  def close(self):
+    pass
+
+
+# Errors of a commit that may succeed if it is retried.
+TRANSIENT_ERRORS = (google_exceptions.Aborted,
+                    google_exceptions.DeadlineExceeded,
+                    google_exceptions.InternalServerError,
+                    google_exceptions.ResourceExhausted,
+                    google_exceptions.ServiceUnavailable)
+
+
+# Commits queued documents in batches from a background thread, so that
+# request handlers do not wait for Firestore round trips.
+class BatchWriter:
+
+  def __init__(self,
+               client,
+               max_queue_size=10000,
+               batch_size=100,
+               flush_interval=1.0,
+               max_retries=5,
+               initial_backoff=0.5,
+               put_timeout=1.0):
+    self.client = client
+    self._queue: queue.Queue[Tuple[document.DocumentReference,
+                                   dict]] = queue.Queue(max_queue_size)
+    # Firestore allows up to 500 writes in a batch.
+    self.batch_size = min(batch_size, 500)
+    # A batch is committed at the latest this many seconds after its first
+    # document is queued.
+    self.flush_interval = flush_interval
+    self.max_retries = max_retries
+    self.initial_backoff = initial_backoff
+    # If the queue stays full for this many seconds, the document is written
+    # synchronously instead.
+    self.put_timeout = put_timeout
+
+    self._stopping = threading.Event()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+
+  # The number of documents waiting to be committed. If it keeps growing,
+  # the writer is falling behind.
+  @property
+  def queue_depth(self) -> int:
+    return self._queue.qsize()
+
+  def start(self):
+    self._thread.start()
+
+  def put(self, doc_ref: document.DocumentReference, doc: dict):
+    if self._stopping.is_set():
+      doc_ref.set(doc)
+      return
+
+    try:
+      self._queue.put((doc_ref, doc), timeout=self.put_timeout)
+    except queue.Full:
+      logger.warning("Write queue is full with %d documents.", self.queue_depth)
+      doc_ref.set(doc)
+
+  # Commits the queued documents and stops the background thread.
+  def stop(self, timeout: float | None = None):
+    self._stopping.set()
+    self._thread.join(timeout)
+
+  def _run(self):
+    while not self._stopping.is_set() or not self._queue.empty():
+      batch = self._take_batch()
+      if batch:
+        self._commit(batch)
+
+  def _take_batch(self) -> List[Tuple[document.DocumentReference, dict]]:
+    try:
+      batch = [self._queue.get(timeout=self.flush_interval)]
+    except queue.Empty:
+      return []
+
+    deadline = time.monotonic() + self.flush_interval
+    while len(batch) < self.batch_size:
+      # Drains the queue without waiting when stopping.
+      remaining = 0 if self._stopping.is_set() else deadline - time.monotonic()
+      try:
+        batch.append(self._queue.get(timeout=max(remaining, 0)))
+      except queue.Empty:
+        break
+    return batch
+
+  def _commit(self, batch: List[Tuple[document.DocumentReference, dict]]):
+    backoff = self.initial_backoff
+    for attempt in range(self.max_retries + 1):
+      try:
+        write_batch = self.client.batch()
+        for doc_ref, doc in batch:
+          write_batch.set(doc_ref, doc)
+        write_batch.commit()
+        return
+
+      except TRANSIENT_ERRORS:
+        if attempt == self.max_retries:
+          logger.exception("Failed to commit %d documents.", len(batch))
+          return
+
+        logger.warning("Failed to commit %d documents. Retrying in %.1fs.",
+                       len(batch), backoff)
+        time.sleep(backoff)
+        backoff *= 2
+
+      # Retrying would fail again, e.g., if a document is invalid, so the
+      # documents are written one by one to lose only the invalid ones.
+      except Exception:  # pylint: disable=broad-except
+        logger.exception(
+            "Failed to commit %d documents. Writing them one by one.",
+            len(batch))
+        self._set_each(batch)
+        return
+
+  def _set_each(self, batch: List[Tuple[document.DocumentReference, dict]]):
+    for doc_ref, doc in batch:
+      try:
+        doc_ref.set(doc)
+      except Exception:  # pylint: disable=broad-except
+        logger.exception("Failed to write the document %s.", doc_ref.id)
+
+
+class FirestoreStorage(Storage):
+
+  def __init__(self, client, ratings_collection: str,
+               summarizations_collection: str, translations_collection: str):
+    self.client = client
+    self.ratings_collection = ratings_collection
+    self.summarizations_collection = summarizations_collection
+    self.translations_collection = translations_collection
+
+    self.batch_writer = BatchWriter(client)
+    self.batch_writer.start()
+    # Shows on /metrics whether the writer is falling behind.
+    add_gauge("arena_write_queue_depth",
+              "Documents waiting to be committed by the batch writer.",
+              lambda: self.batch_writer.queue_depth)
+
+  def get_ratings(self, category: Category, source_lang: str,
+                  target_lang: str | None) -> List[Rating] | None:
+    # TODO(#37): Make it more clear what fields are in the document.
+    doc_dict = self._get_ratings_doc_ref(category, source_lang,
+                                         target_lang).get().to_dict()
+    if doc_dict is None:
+      return None
+
+    # TODO(#37): Return the timestamp as well.
+    doc_dict.pop("timestamp", None)
+
+    return [Rating(model, rating) for model, rating in doc_dict.items()]
+
+  def set_ratings(self, category: Category, ratings: List[Rating],
+                  source_lang: str, target_lang: str | None):
+    doc_ref = self._get_ratings_doc_ref(category, source_lang, target_lang)
 
-  if category == Category.SUMMARIZATION:
-    collection = db.collection(SUMMARIZATIONS_COLLECTION).order_by("timestamp")
+    new_ratings = {rating.model: rating.rating for rating in ratings}
+    new_ratings["timestamp"] = firestore.SERVER_TIMESTAMP
+    doc_ref.set(new_ratings, merge=True)
 
-    if source_lang_lowercase:
-      collection = collection.where(filter=base_query.FieldFilter(
-          "model_a_response_language", "==", source_lang_lowercase)).where(
-              filter=base_query.FieldFilter("model_b_response_language", "==",
-                                            source_lang_lowercase))
+  def get_rating_checkpoint(self, category: Category, engine: str,
+                            source_lang: str,
+                            target_lang: str | None) -> RatingCheckpoint | None:
+    doc_dict = self._get_checkpoint_doc_ref(category, engine, source_lang,
+                                            target_lang).get().to_dict()
+    # Checkpoints without pair counts are rebuilt from scratch.
+    if doc_dict is None or "wins" not in doc_dict:
+      return None
 
-  elif category == Category.TRANSLATION:
-    collection = db.collection(TRANSLATIONS_COLLECTION).order_by("timestamp")
+    return RatingCheckpoint(doc_dict["ratings"], doc_dict["wins"],
+                            doc_dict["ties"], doc_dict["last_timestamp"],
+                            doc_dict["last_battle_id"])
 
-    if source_lang_lowercase:
-      collection = collection.where(filter=base_query.FieldFilter(
-          "source_language", "==", source_lang_lowercase))
+  def set_rating_checkpoint(self, category: Category, engine: str,
+                            checkpoint: RatingCheckpoint, source_lang: str,
+                            target_lang: str | None):
+    doc_ref = self._get_checkpoint_doc_ref(category, engine, source_lang,
+                                           target_lang)
+    doc_ref.set({
+        "ratings": checkpoint.ratings,
+        "wins": checkpoint.wins,
+        "ties": checkpoint.ties,
+        "last_timestamp": checkpoint.last_timestamp,
+        "last_battle_id": checkpoint.last_battle_id,
+        "timestamp": firestore.SERVER_TIMESTAMP
+    })
 
-    if target_lang_lowercase:
-      collection = collection.where(filter=base_query.FieldFilter(
-          "target_language", "==", target_lang_lowercase))
+  def get_battle_columns(self,
+                         category: Category,
+                         source_lang: str | None,
+                         target_lang: str | None,
+                         after: Tuple[datetime, str] | None = None,
+                         with_languages: bool = False) -> BattleColumns:
+    # Only the needed fields are sent, rather than the prompts and responses.
+    fields = BATTLE_COLUMN_FIELDS + (BATTLE_LANGUAGE_FIELDS[category]
+                                     if with_languages else [])
+    docs = self._query_battles(category, source_lang, target_lang,
+                               after).select(fields).stream()
 
-  else:
+    def get_rows():
+      for doc in docs:
+        data = doc.to_dict()
+        source_lang, target_lang = None, None
+        if with_languages and category == Category.SUMMARIZATION:
+          if data.get("model_a_response_language") == data.get(
+              "model_b_response_language"):
+            source_lang = data.get("model_a_response_language")
+        elif with_languages:
+          source_lang = data.get("source_language")
+          target_lang = data.get("target_language")
+
+        yield (data["model_a"], data["model_b"], data["winner"],
+               _to_microseconds(data["timestamp"]), doc.id, source_lang,
+               target_lang)
+
+    return BattleColumns.from_rows(get_rows(), with_languages)
+
+  def add_battle(self, category: Category, doc: dict):
+    self._add(self._get_battles_collection(category), doc)
+
+  def add_history(self, category: Category, doc: dict):
+    self._add(
+        self.client.collection(
+            SUMMARIZATION_HISTORY_COLLECTION if category ==
+            Category.SUMMARIZATION else TRANSLATION_HISTORY_COLLECTION), doc)
+
+  # Commits the queued history and votes.
+  def close(self):
+    self.batch_writer.stop()
+
+  def _add(self, collection, doc: dict):
+    doc_id = uuid4().hex
+    doc = {"id": doc_id, **doc}
+    doc["timestamp"] = firestore.SERVER_TIMESTAMP
+    self.batch_writer.put(collection.document(doc_id), doc)
+
+  def _query_battles(self, category: Category, source_lang: str | None,
+                     target_lang: str | None,
+                     after: Tuple[datetime, str] | None):
+    source_lang_lowercase = source_lang.lower() if source_lang else None
+    target_lang_lowercase = target_lang.lower() if target_lang else None
+
+    collection_ref = self._get_battles_collection(category)
+    # Battles are ordered by document ID as well, so that battles with the
+    # same timestamp are not skipped when resuming from a checkpoint.
+    collection = collection_ref.order_by("timestamp").order_by(
+        FieldPath.document_id())
+
+    if category == Category.SUMMARIZATION:
+      if source_lang_lowercase:
+        collection = collection.where(filter=base_query.FieldFilter(
+            "model_a_response_language", "==", source_lang_lowercase)).where(
+                filter=base_query.FieldFilter("model_b_response_language", "==",
+                                              source_lang_lowercase))
+
+    else:
+      if source_lang_lowercase:
+        collection = collection.where(filter=base_query.FieldFilter(
+            "source_language", "==", source_lang_lowercase))
+
+      if target_lang_lowercase:
+        collection = collection.where(filter=base_query.FieldFilter(
+            "target_language", "==", target_lang_lowercase))
+
+    if after:
+      last_timestamp, last_battle_id = after
+      collection = collection.start_after({
+          "timestamp": last_timestamp,
+          FieldPath.document_id(): collection_ref.document(last_battle_id)
+      })
+
+    return collection
+
+  def _get_battles_collection(self, category: Category):
+    if category == Category.SUMMARIZATION:
+      return self.client.collection(self.summarizations_collection)
+    if category == Category.TRANSLATION:
+      return self.client.collection(self.translations_collection)
     raise ValueError(f"Invalid category: {category}")
 
-  docs = collection.stream()
-  battles = []
-  for doc in docs:
-    data = doc.to_dict()
-    battles.append(Battle(data["model_a"], data["model_b"], data["winner"]))
-  return battles
+  def _get_ratings_doc_ref(self, category: Category, source_lang: str,
+                           target_lang: str | None):
+    return self.client.collection(self.ratings_collection).document(
+        _get_ratings_doc_id(category, source_lang, target_lang))
+
+  # Each rating engine keeps its own checkpoint, e.g., "elo".
+  def _get_checkpoint_doc_ref(self, category: Category, engine: str,
+                              source_lang: str, target_lang: str | None):
+    return self._get_ratings_doc_ref(
+        category, source_lang,
+        target_lang).collection(CHECKPOINTS_COLLECTION).document(engine)
+
+
+def _to_microseconds(timestamp: datetime) -> int:
+  if timestamp.tzinfo is None:
+    timestamp = timestamp.replace(tzinfo=timezone.utc)
+  return (timestamp -
+          datetime.fromtimestamp(0, timezone.utc)) // (datetime.resolution)
+
+
+def _get_current_microseconds() -> int:
+  return _to_microseconds(datetime.now(timezone.utc))
+
+
+def _from_microseconds(microseconds: int) -> datetime:
+  return datetime.fromtimestamp(
+      0, timezone.utc) + microseconds * (datetime.resolution)
+
+
+# Timestamps are stored as microseconds since the epoch. The fields that are
+# not queried, e.g., the prompt and responses, are kept as JSON in `doc`.
+class SqliteStorage(Storage):
+
+  def __init__(self, path: str):
+    self.path = path
+    # Each statement is committed on its own, except in the explicit
+    # transaction of `set_ratings`.
+    self._connection = ThreadLocalConnection(path)
+
+    with self._connection.get() as connection:
+      connection.executescript("""
+        CREATE TABLE IF NOT EXISTS battles (
+          id TEXT PRIMARY KEY,
+          category TEXT NOT NULL,
+          model_a TEXT NOT NULL,
+          model_b TEXT NOT NULL,
+          winner TEXT NOT NULL,
+          model_a_response_language TEXT,
+          model_b_response_language TEXT,
+          source_language TEXT,
+          target_language TEXT,
+          timestamp INTEGER NOT NULL,
+          doc TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS battles_category_timestamp
+          ON battles (category, timestamp, id);
+        CREATE INDEX IF NOT EXISTS battles_response_languages
+          ON battles (category, model_a_response_language,
+                      model_b_response_language, timestamp, id);
+        CREATE INDEX IF NOT EXISTS battles_translation_languages
+          ON battles (category, source_language, target_language, timestamp,
+                      id);
+        CREATE INDEX IF NOT EXISTS battles_target_language
+          ON battles (category, target_language, timestamp, id);
+
+        CREATE TABLE IF NOT EXISTS history (
+          id TEXT PRIMARY KEY,
+          category TEXT NOT NULL,
+          model TEXT NOT NULL,
+          timestamp INTEGER NOT NULL,
+          doc TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_category_timestamp
+          ON history (category, timestamp);
+
+        CREATE TABLE IF NOT EXISTS ratings (
+          id TEXT PRIMARY KEY,
+          ratings TEXT NOT NULL,
+          timestamp INTEGER NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS checkpoints (
+          id TEXT NOT NULL,
+          engine TEXT NOT NULL,
+          checkpoint TEXT NOT NULL,
+          timestamp INTEGER NOT NULL,
+          PRIMARY KEY (id, engine)
+        );
+      """)
+
+  def get_ratings(self, category: Category, source_lang: str,
+                  target_lang: str | None) -> List[Rating] | None:
+    with self._connection.get() as connection:
+      row = connection.execute("SELECT ratings FROM ratings WHERE id = ?",
+                               (_get_ratings_doc_id(category, source_lang,
+                                                    target_lang),)).fetchone()
+    if row is None:
+      return None
+
+    return [
+        Rating(model, rating) for model, rating in json.loads(row[0]).items()
+    ]
+
+  def set_ratings(self, category: Category, ratings: List[Rating],
+                  source_lang: str, target_lang: str | None):
+    doc_id = _get_ratings_doc_id(category, source_lang, target_lang)
+    connection = self._connection.get()
+    # Merges the ratings into the stored ones like the Firestore backend.
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+      row = connection.execute("SELECT ratings FROM ratings WHERE id = ?",
+                               (doc_id,)).fetchone()
+      new_ratings = json.loads(row[0]) if row else {}
+      new_ratings.update({rating.model: rating.rating for rating in ratings})
+      connection.execute(
+          "INSERT OR REPLACE INTO ratings VALUES (?, ?, ?)",
+          (doc_id, json.dumps(new_ratings), _get_current_microseconds()))
+      connection.execute("COMMIT")
+    except BaseException:
+      connection.execute("ROLLBACK")
+      raise
+
+  def get_rating_checkpoint(self, category: Category, engine: str,
+                            source_lang: str,
+                            target_lang: str | None) -> RatingCheckpoint | None:
+    with self._connection.get() as connection:
+      row = connection.execute(
+          "SELECT checkpoint FROM checkpoints WHERE id = ? AND engine = ?",
+          (_get_ratings_doc_id(category, source_lang,
+                               target_lang), engine)).fetchone()
+    if row is None:
+      return None
+
+    checkpoint = json.loads(row[0])
+    return RatingCheckpoint(checkpoint["ratings"], checkpoint["wins"],
+                            checkpoint["ties"],
+                            _from_microseconds(checkpoint["last_timestamp"]),
+                            checkpoint["last_battle_id"])
+
+  def set_rating_checkpoint(self, category: Category, engine: str,
+                            checkpoint: RatingCheckpoint, source_lang: str,
+                            target_lang: str | None):
+    with self._connection.get() as connection:
+      connection.execute(
+          "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+          (_get_ratings_doc_id(category, source_lang, target_lang), engine,
+           json.dumps({
+               "ratings": checkpoint.ratings,
+               "wins": checkpoint.wins,
+               "ties": checkpoint.ties,
+               "last_timestamp": _to_microseconds(checkpoint.last_timestamp),
+               "last_battle_id": checkpoint.last_battle_id,
+           }), _get_current_microseconds()))
+
+  def get_battle_columns(self,
+                         category: Category,
+                         source_lang: str | None,
+                         target_lang: str | None,
+                         after: Tuple[datetime, str] | None = None,
+                         with_languages: bool = False) -> BattleColumns:
+    return BattleColumns.from_rows(
+        self._select_battles(category, source_lang, target_lang, after),
+        with_languages)
+
+  def add_battle(self, category: Category, doc: dict):
+    doc = dict(doc)
+    columns = [
+        doc.pop("model_a"),
+        doc.pop("model_b"),
+        doc.pop("winner"),
+        doc.pop("model_a_response_language", None),
+        doc.pop("model_b_response_language", None),
+        doc.pop("source_language", None),
+        doc.pop("target_language", None),
+    ]
+    with self._connection.get() as connection:
+      connection.execute(
+          "INSERT INTO battles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+          (uuid4().hex, category.value, *columns, _get_current_microseconds(),
+           json.dumps(doc)))
+
+  def add_history(self, category: Category, doc: dict):
+    with self._connection.get() as connection:
+      connection.execute("INSERT INTO history VALUES (?, ?, ?, ?, ?)",
+                         (uuid4().hex, category.value, doc["model"],
+                          _get_current_microseconds(), json.dumps(doc)))
+
+  # Returns a cursor over the rows of the battles as
+  # BattleColumns.from_rows takes them.
+  def _select_battles(self, category: Category, source_lang: str | None,
+                      target_lang: str | None,
+                      after: Tuple[datetime, str] | None) -> sqlite3.Cursor:
+    conditions = ["category = ?"]
+    params = [category.value]
+
+    if category == Category.SUMMARIZATION:
+      if source_lang:
+        conditions.append("model_a_response_language = ?")
+        conditions.append("model_b_response_language = ?")
+        params += [source_lang.lower(), source_lang.lower()]
+
+    else:
+      if source_lang:
+        conditions.append("source_language = ?")
+        params.append(source_lang.lower())
+      if target_lang:
+        conditions.append("target_language = ?")
+        params.append(target_lang.lower())
+
+    if after:
+      last_timestamp, last_battle_id = after
+      conditions.append("(timestamp, id) > (?, ?)")
+      params += [_to_microseconds(last_timestamp), last_battle_id]
+
+    if category == Category.SUMMARIZATION:
+      languages = ("CASE WHEN model_a_response_language = "
+                   "model_b_response_language THEN model_a_response_language "
+                   "END, NULL")
+    else:
+      languages = "source_language, target_language"
+
+    return self._connection.get().execute(
+        f"SELECT model_a, model_b, winner, timestamp, id, {languages} "
+        f"FROM battles WHERE {' AND '.join(conditions)} "
+        "ORDER BY timestamp, id", params)
+
+
+def create_storage(backend: str) -> Storage:
+  if backend == "firestore":
+    firebase_admin.initialize_app(
+        credentials.Certificate(get_credentials_json()))
+    return FirestoreStorage(firestore.client(),
+                            get_required_env("RATINGS_COLLECTION"),
+                            get_required_env("SUMMARIZATIONS_COLLECTION"),
+                            get_required_env("TRANSLATIONS_COLLECTION"))
+  if backend == "sqlite":
+    return SqliteStorage(STORAGE_DB_PATH)
+  raise ValueError(f"Unknown storage backend: {backend}")
+
+
+if gr.NO_RELOAD:
+  storage = create_storage(STORAGE_BACKEND)
+  add_shutdown_hook(storage.close)
+
+
+def get_ratings(category: Category, source_lang: str,
+                target_lang: str | None) -> List[Rating] | None:
+  return storage.get_ratings(category, source_lang, target_lang)
+
+
+def set_ratings(category: Category, ratings: List[Rating], source_lang: str,
+                target_lang: str | None):
+  storage.set_ratings(category, ratings, source_lang, target_lang)
+
+
+def get_rating_checkpoint(category: Category, engine: str, source_lang: str,
+                          target_lang: str | None) -> RatingCheckpoint | None:
+  return storage.get_rating_checkpoint(category, engine, source_lang,
+                                       target_lang)
+
+
+def set_rating_checkpoint(category: Category, engine: str,
+                          checkpoint: RatingCheckpoint, source_lang: str,
+                          target_lang: str | None):
+  storage.set_rating_checkpoint(category, engine, checkpoint, source_lang,
+                                target_lang)
+
+
+def get_battle_columns(category: Category,
+                       source_lang: str | None,
+                       target_lang: str | None,
+                       after: Tuple[datetime, str] | None = None,
+                       with_languages: bool = False) -> BattleColumns:
+  return storage.get_battle_columns(category, source_lang, target_lang, after,
+                                    with_languages)
+
+
+def add_battle(category: Category, doc: dict):
+  storage.add_battle(category, doc)
+
+
+def add_history(category: Category, doc: dict):
+  storage.add_history(category, doc)
@@ -0,0 +1,157 @@
+"""
+This module tracks the health of models and providers from the outcomes of
+completions, so that failing ones are skipped when sampling models.
+
+Each model and each provider has a circuit breaker:
+1. Closed: Requests are allowed. It opens after `failure_threshold`
+   consecutive failures, where calls slower than `slow_call_threshold` count
+   as failures.
+
+2. Open: Requests are not allowed. After `reset_timeout` seconds it becomes
+   half-open.
+
+3. Half-open: A single probe request is allowed. It closes if the probe
+   succeeds and opens again otherwise.
+"""
+
+import contextlib
+import enum
+import os
+import threading
+import time
+from typing import Dict, Iterator
+
+
+class ProviderBusyError(Exception):
+  pass
+
+
+class CircuitState(enum.Enum):
+  CLOSED = "closed"
+  OPEN = "open"
+  HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+
+  def __init__(self, failure_threshold: int, reset_timeout: float):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+
+    self.consecutive_failures = 0
+    self.opened_at: float | None = None
+    self.probe_in_flight = False
+
+  @property
+  def state(self) -> CircuitState:
+    if self.opened_at is None:
+      return CircuitState.CLOSED
+    if time.monotonic() - self.opened_at < self.reset_timeout:
+      return CircuitState.OPEN
+    return CircuitState.HALF_OPEN
+
+  def allows_request(self) -> bool:
+    state = self.state
+    if state == CircuitState.HALF_OPEN:
+      return not self.probe_in_flight
+    return state == CircuitState.CLOSED
+
+  def on_request(self):
+    if self.state == CircuitState.HALF_OPEN:
+      self.probe_in_flight = True
+
+  def record_success(self):
+    self.consecutive_failures = 0
+    self.opened_at = None
+    self.probe_in_flight = False
+
+  def record_failure(self):
+    self.consecutive_failures += 1
+    if (self.state == CircuitState.HALF_OPEN or
+        self.consecutive_failures >= self.failure_threshold):
+      self.opened_at = time.monotonic()
+    self.probe_in_flight = False
+
+
+class HealthTracker:
+
+  def __init__(self,
+               failure_threshold=3,
+               reset_timeout=60.0,
+               slow_call_threshold=60.0,
+               max_concurrency_per_provider=16,
+               acquire_timeout=10.0):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.slow_call_threshold = slow_call_threshold
+    self.max_concurrency_per_provider = max_concurrency_per_provider
+    # How long a request waits for a free slot of its provider.
+    self.acquire_timeout = acquire_timeout
+
+    self._breakers: Dict[str, CircuitBreaker] = {}
+    self._slots: Dict[str, threading.BoundedSemaphore] = {}
+    self._in_flight: Dict[str, int] = {}
+    self._lock = threading.Lock()
+
+  # Returns whether requests to the model should be sent now, i.e., neither
+  # the model's nor the provider's circuit is open and the provider has a
+  # free slot.
+  def is_available(self, model_name: str, provider: str) -> bool:
+    with self._lock:
+      return (self._get_breaker(f"model:{model_name}").allows_request() and
+              self._get_breaker(f"provider:{provider}").allows_request() and
+              self._in_flight.get(provider,
+                                  0) < self.max_concurrency_per_provider)
+
+  # Tracks a request to the model. The request is counted as failed if it
+  # raises an exception other than `ignored_exceptions`, which do not tell
+  # anything about the health, e.g., a prompt that is too long.
+  @contextlib.contextmanager
+  def track(self, model_name: str, provider: str,
+            ignored_exceptions=()) -> Iterator[None]:
+    with self._lock:
+      slots = self._slots.setdefault(
+          provider,
+          threading.BoundedSemaphore(self.max_concurrency_per_provider))
+    if not slots.acquire(timeout=self.acquire_timeout):
+      raise ProviderBusyError(f"Provider {provider} is busy.")
+
+    breakers = [f"model:{model_name}", f"provider:{provider}"]
+    with self._lock:
+      self._in_flight[provider] = self._in_flight.get(provider, 0) + 1
+      for key in breakers:
+        self._get_breaker(key).on_request()
+
+    start = time.monotonic()
+    succeeded = False
+    try:
+      yield
+      succeeded = True
+    except ignored_exceptions:
+      succeeded = True
+      raise
+    finally:
+      latency = time.monotonic() - start
+      with self._lock:
+        self._in_flight[provider] -= 1
+        for key in breakers:
+          if succeeded and latency < self.slow_call_threshold:
+            self._get_breaker(key).record_success()
+          else:
+            self._get_breaker(key).record_failure()
+      slots.release()
+
+  def _get_breaker(self, key: str) -> CircuitBreaker:
+    breaker = self._breakers.get(key)
+    if breaker is None:
+      breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+      self._breakers[key] = breaker
+    return breaker
+
+
+health_tracker = HealthTracker(
+    failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3")),
+    reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "60")),
+    slow_call_threshold=float(os.getenv("CIRCUIT_SLOW_CALL_THRESHOLD", "60")),
+    max_concurrency_per_provider=int(os.getenv("PROVIDER_MAX_CONCURRENCY",
+                                               "16")))
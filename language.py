@@ -0,0 +1,107 @@
+"""
+This module provides a shared language detector that is built on first use.
+"""
+
+import logging
+import os
+import resource
+import threading
+import time
+from typing import List
+
+import lingua
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+SUPPORTED_LANGUAGES = [
+    language.name.capitalize() for language in lingua.Language.all()
+]
+
+# Comma-separated names of the languages to detect, e.g., "english,korean".
+# If it is not set, all languages are detected.
+DETECTOR_LANGUAGES = os.getenv("DETECTOR_LANGUAGES")
+# Trades accuracy on short texts for less memory and faster detection.
+DETECTOR_LOW_ACCURACY = os.getenv("DETECTOR_LOW_ACCURACY") == "true"
+# Loads the language models at startup rather than on demand.
+DETECTOR_PRELOAD = os.getenv("DETECTOR_PRELOAD") == "true"
+
+
+def parse_languages(names: str | None) -> List[lingua.Language] | None:
+  if not names:
+    return None
+
+  languages = [
+      lingua.Language.from_str(name.strip())
+      for name in names.split(",")
+      if name.strip()
+  ]
+  if len(languages) < 2:
+    raise ValueError("At least two languages are required for detection.")
+  return languages
+
+
+class LanguageDetector:
+
+  def __init__(self,
+               languages: List[lingua.Language] | None = None,
+               low_accuracy: bool = False):
+    # None means all languages.
+    self.languages = languages
+    self.low_accuracy = low_accuracy
+
+    self._detector: lingua.LanguageDetector | None = None
+    self._lock = threading.Lock()
+
+  def detect_language_of(self, text: str) -> lingua.Language | None:
+    return self._get_detector().detect_language_of(text)
+
+  # Builds the detector with all of its language models loaded, so that the
+  # first detection does not have to wait for them.
+  def preload(self):
+    self._get_detector(preload_models=True)
+
+  # Frees the language models. They are loaded again on the next detection.
+  def unload(self):
+    with self._lock:
+      if self._detector is not None:
+        self._detector.unload_language_models()
+        self._detector = None
+
+  def _get_detector(self,
+                    preload_models: bool = False) -> lingua.LanguageDetector:
+    language_detector = self._detector
+    if language_detector is not None:
+      return language_detector
+
+    with self._lock:
+      if self._detector is None:
+        self._detector = self._build(preload_models)
+      return self._detector
+
+  def _build(self, preload_models: bool) -> lingua.LanguageDetector:
+    start = time.perf_counter()
+
+    if self.languages is None:
+      builder = lingua.LanguageDetectorBuilder.from_all_languages()
+    else:
+      builder = lingua.LanguageDetectorBuilder.from_languages(*self.languages)
+    if self.low_accuracy:
+      builder = builder.with_low_accuracy_mode()
+    if preload_models:
+      builder = builder.with_preloaded_language_models()
+    language_detector = builder.build()
+
+    # ru_maxrss is in kilobytes on Linux.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logger.info(
+        "Built language detector for %s languages in %.2fs. "
+        "Peak RSS: %.1f MiB.",
+        len(self.languages) if self.languages else "all",
+        time.perf_counter() - start, peak_rss)
+    return language_detector
+
+
+detector = LanguageDetector(parse_languages(DETECTOR_LANGUAGES),
+                            DETECTOR_LOW_ACCURACY)
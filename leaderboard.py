@@ -2,20 +2,38 @@
 It provides a leaderboard component.
 """
 
-from collections import defaultdict
+import contextlib
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import timezone
 import enum
-import math
+import logging
+import os
+import tempfile
+import threading
+import time
 from typing import Dict, List, Tuple
 
 import gradio as gr
-import lingua
+import msgpack
+import numpy as np
 
 import db
-from db import get_battles
-
-SUPPORTED_LANGUAGES = [
-    language.name.capitalize() for language in lingua.Language.all()
-]
+from db import get_battle_columns
+from language import SUPPORTED_LANGUAGES
+from rating import bootstrap_intervals
+from rating import fit_bradley_terry
+from rating import PairCounts
+from rating import RatingEngine
+from rating import round_ratings
+from rating import update_elo_columns
+from sampling import pair_sampler
+from scheduler import scheduler
+import tracing
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
 ANY_LANGUAGE = "Any"
 
@@ -25,51 +43,146 @@ class LeaderboardTab(enum.Enum):
   TRANSLATION = "Translation"
 
 
-# Ref: https://colab.research.google.com/drive/1RAWb22-PFNI-X1gPVzc927SGUdfr6nsR?usp=sharing#scrollTo=QLGc6DwxyvQc pylint: disable=line-too-long
-def compute_elo(battles: List[db.Battle],
-                k=4,
-                scale=400,
-                base=10,
-                initial_rating=1000) -> Dict[str, int]:
-  rating = defaultdict(lambda: initial_rating)
-
-  for battle in battles:
-    model_a, model_b, winner = battle.model_a, battle.model_b, battle.winner
-
-    rating_a = rating[model_a]
-    rating_b = rating[model_b]
-
-    expected_score_a = 1 / (1 + base**((rating_b - rating_a) / scale))
-    expected_score_b = 1 / (1 + base**((rating_a - rating_b) / scale))
-
-    scored_point_a = 0.5 if winner == "tie" else int(winner == "model_a")
-
-    rating[model_a] += k * (scored_point_a - expected_score_a)
-    rating[model_b] += k * (1 - scored_point_a - expected_score_b)
-
-  return {model: math.floor(rating + 0.5) for model, rating in rating.items()}
-
-
-def load_elo_ratings(tab, source_lang: str, target_lang: str | None):
-  category = db.Category.SUMMARIZATION if tab == LeaderboardTab.SUMMARIZATION else db.Category.TRANSLATION
-
-  # TODO(#37): Call db.get_ratings and return the ratings if exists.
-
-  battles = get_battles(category,
-                        None if source_lang == ANY_LANGUAGE else source_lang,
-                        None if target_lang == ANY_LANGUAGE else target_lang)
-  if not battles:
-    return
-
-  computed_ratings = compute_elo(battles)
-
-  db.set_ratings(
+CATEGORIES = {
+    LeaderboardTab.SUMMARIZATION: db.Category.SUMMARIZATION,
+    LeaderboardTab.TRANSLATION: db.Category.TRANSLATION,
+}
+
+# The rating engine used by each tab, either "elo" or "bradley_terry".
+RATING_ENGINES = {
+    LeaderboardTab.SUMMARIZATION:
+        RatingEngine(os.getenv("SUMMARIZATION_RATING_ENGINE", "elo")),
+    LeaderboardTab.TRANSLATION:
+        RatingEngine(os.getenv("TRANSLATION_RATING_ENGINE", "elo")),
+}
+
+RATING_LABELS = {
+    RatingEngine.ELO: "Elo rating",
+    RatingEngine.BRADLEY_TERRY: "Bradley-Terry rating",
+}
+
+# The number of bootstrap rounds used to estimate the confidence intervals.
+# Set it to 0 to disable the intervals.
+BOOTSTRAP_ROUNDS = int(os.getenv("BOOTSTRAP_ROUNDS", "100"))
+# Only the bootstrap rounds finished within this many seconds are used.
+BOOTSTRAP_TIME_BUDGET = float(os.getenv("BOOTSTRAP_TIME_BUDGET", "10"))
+
+# The confidence intervals of each leaderboard and the battle they were
+# bootstrapped up to.
+_intervals_cache: Dict[Tuple[LeaderboardTab, str, str | None],
+                       Tuple[Tuple[datetime, str], dict]] = {}
+
+LEADERBOARD_HEADERS = {
+    tab: ["Rank", "Model", RATING_LABELS[engine], "95% CI", "Battles"]
+    for tab, engine in RATING_ENGINES.items()
+}
+LEADERBOARD_DATATYPES = ["number", "str", "number", "str", "number"]
+# The language-filtered leaderboards have no confidence intervals, as they are
+# read from the materialized ratings.
+FILTERED_LEADERBOARD_HEADERS = {
+    tab: ["Rank", "Model", RATING_LABELS[engine], "Battles"]
+    for tab, engine in RATING_ENGINES.items()
+}
+FILTERED_LEADERBOARD_DATATYPES = ["number", "str", "number", "number"]
+
+
+# The rows of a leaderboard as of `updated_at`, computed from the battles up
+# to the checkpoint at the last battle.
+@dataclass
+class LeaderboardSnapshot:
+  rows: List[list]
+  updated_at: datetime
+  last_battle_timestamp: datetime | None
+  last_battle_id: str | None
+
+
+def load_elo_ratings(tab,
+                     source_lang: str,
+                     target_lang: str | None,
+                     full_rebuild: bool = False):
+  snapshot = compute_leaderboard(tab, source_lang, target_lang, full_rebuild)
+  return snapshot.rows if snapshot else None
+
+
+# Only the battles after the stored checkpoint are fetched and folded into the
+# stored ratings. If `full_rebuild` is set, the ratings are recomputed from
+# every battle instead. Returns None if there are no battles.
+@tracing.traced("compute_leaderboard")
+def compute_leaderboard(
+    tab,
+    source_lang: str,
+    target_lang: str | None,
+    full_rebuild: bool = False) -> LeaderboardSnapshot | None:
+  category = CATEGORIES[tab]
+  engine = RATING_ENGINES[tab]
+  checkpoint = None if full_rebuild else db.get_rating_checkpoint(
+      category, engine.value, source_lang, target_lang)
+
+  battles = get_battle_columns(
       category,
-      [db.Rating(model, rating) for model, rating in computed_ratings.items()],
-      source_lang, target_lang)
-
+      None if source_lang == ANY_LANGUAGE else source_lang,
+      None if target_lang == ANY_LANGUAGE else target_lang,
+      after=(checkpoint.last_timestamp,
+             checkpoint.last_battle_id) if checkpoint else None)
+  if not battles and checkpoint is None:
+    return None
+
+  ratings = dict(checkpoint.ratings) if checkpoint else {}
+  counts = PairCounts.from_dicts(
+      checkpoint.wins, checkpoint.ties) if checkpoint else PairCounts.empty()
+
+  if battles:
+    counts.add_arrays(battles.models, battles.model_a, battles.model_b,
+                      battles.winner)
+
+    if engine == RatingEngine.ELO:
+      update_elo_columns(ratings, battles)
+    else:
+      ratings = fit_bradley_terry(counts)
+
+    db.set_rating_checkpoint(
+        category, engine.value,
+        db.RatingCheckpoint(ratings, *counts.to_dicts(), battles.last_timestamp,
+                            battles.last_battle_id), source_lang, target_lang)
+
+  # The pair sampler of the arena uses the ratings over all languages.
+  if source_lang == ANY_LANGUAGE and target_lang in (None, ANY_LANGUAGE):
+    pair_sampler.update(category.value, ratings, counts)
+
+  computed_ratings = round_ratings(ratings)
+
+  if battles:
+    db.set_ratings(category, [
+        db.Rating(model, rating) for model, rating in computed_ratings.items()
+    ], source_lang, target_lang)
+
+  if battles:
+    cursor = (battles.last_timestamp, battles.last_battle_id)
+  else:
+    cursor = (checkpoint.last_timestamp, checkpoint.last_battle_id)
+
+  # The intervals only change with the battles, so they are bootstrapped
+  # again only when the checkpoint advances.
+  key = (tab, source_lang, target_lang)
+  cached_cursor, intervals = _intervals_cache.get(key, (None, {}))
+  if full_rebuild or cached_cursor != cursor:
+    intervals = bootstrap_intervals(counts, engine, BOOTSTRAP_ROUNDS,
+                                    BOOTSTRAP_TIME_BUDGET)
+    # Intervals that timed out are bootstrapped again next time.
+    if intervals:
+      _intervals_cache[key] = (cursor, intervals)
+
+  rows = build_rating_rows(computed_ratings, intervals, counts.num_battles())
+  return LeaderboardSnapshot(rows, datetime.now(), *cursor)
+
+
+# Returns the rows of the leaderboard table, where `intervals` holds the
+# confidence interval of each model. If it is None, the rows have no
+# confidence interval column.
+def build_rating_rows(ratings: Dict[str, int], intervals: dict | None,
+                      num_battles: Dict[str, int]) -> List[list]:
   sorted_ratings = sorted(
-      computed_ratings.items(),
+      ratings.items(),
       key=lambda x: x[1],  # rating
       reverse=True)
 
@@ -80,7 +193,15 @@ def load_elo_ratings(tab, source_lang: str, target_lang: str | None):
     if rating != last_rating:
       rank = index + 1
 
-    rating_rows.append([rank, model, rating])
+    if intervals is None:
+      rating_rows.append([rank, model, rating, num_battles.get(model, 0)])
+    else:
+      interval = intervals.get(model)
+      rating_rows.append([
+          rank, model, rating,
+          f"[{interval[0]}, {interval[1]}]" if interval else "",
+          num_battles.get(model, 0)
+      ])
     last_rating = rating
 
   return rating_rows
@@ -89,10 +210,312 @@ def load_elo_ratings(tab, source_lang: str, target_lang: str | None):
 LEADERBOARD_UPDATE_INTERVAL = 600  # 10 minutes
 LEADERBOARD_INFO = "The leaderboard is updated every 10 minutes."
 
+# Where the snapshots are kept across restarts.
+LEADERBOARD_SNAPSHOT_PATH = os.getenv("LEADERBOARD_SNAPSHOT_PATH",
+                                      ".leaderboard_snapshots.msgpack")
+
+# The snapshots are computed once per interval by a background job and served
+# to every client.
+_snapshots: Dict[LeaderboardTab, LeaderboardSnapshot] = {}
+# Held while the snapshot of a tab is computed, so that concurrent misses
+# wait for one computation instead of each running their own.
+_snapshot_locks = {tab: threading.Lock() for tab in LeaderboardTab}
+
+
+def get_language_filter(tab: LeaderboardTab) -> Tuple[str, str | None]:
+  if tab == LeaderboardTab.SUMMARIZATION:
+    return ANY_LANGUAGE, None
+  return ANY_LANGUAGE, ANY_LANGUAGE
+
+
+def _compute_snapshot(tab: LeaderboardTab) -> LeaderboardSnapshot:
+  snapshot = compute_leaderboard(tab, *get_language_filter(tab))
+  if snapshot is None:
+    snapshot = LeaderboardSnapshot([], datetime.now(), None, None)
+  _snapshots[tab] = snapshot
+  return snapshot
+
+
+def refresh_leaderboards():
+  for tab in LeaderboardTab:
+    with _snapshot_locks[tab]:
+      _compute_snapshot(tab)
+  save_snapshots()
+
+
+# Saves the snapshots to LEADERBOARD_SNAPSHOT_PATH, from which they are loaded
+# at startup so that the first visitors do not wait for them to be computed.
+def save_snapshots():
+  data = {
+      tab.value: _snapshot_to_dict(snapshot)
+      for tab, snapshot in list(_snapshots.items())
+  }
+  # Written to a temporary file of this process first, so that a crash or
+  # another server process does not leave a partial file behind.
+  temp_path = None
+  try:
+    with tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(LEADERBOARD_SNAPSHOT_PATH) or ".",
+        prefix=os.path.basename(LEADERBOARD_SNAPSHOT_PATH) + ".",
+        suffix=".tmp",
+        delete=False) as snapshot_file:
+      temp_path = snapshot_file.name
+      snapshot_file.write(msgpack.packb(data))
+    os.replace(temp_path, LEADERBOARD_SNAPSHOT_PATH)
+  except OSError:
+    logger.exception("Failed to save the leaderboard snapshots.")
+    if temp_path is not None:
+      with contextlib.suppress(OSError):
+        os.remove(temp_path)
+
+
+def load_snapshots() -> Dict[LeaderboardTab, LeaderboardSnapshot]:
+  tab_values = {tab.value for tab in LeaderboardTab}
+  try:
+    with open(LEADERBOARD_SNAPSHOT_PATH, "rb") as snapshot_file:
+      data = msgpack.unpackb(snapshot_file.read())
+    return {
+        LeaderboardTab(value): _snapshot_from_dict(snapshot)
+        for value, snapshot in data.items()
+        if value in tab_values
+    }
+  except FileNotFoundError:
+    return {}
+  except (OSError, ValueError, KeyError):
+    logger.exception("Failed to load the leaderboard snapshots.")
+    return {}
+
+
+# Timestamps are stored as seconds since the epoch.
+def _snapshot_to_dict(snapshot: LeaderboardSnapshot) -> dict:
+  last_battle_timestamp = None
+  if snapshot.last_battle_timestamp is not None:
+    last_battle_timestamp = snapshot.last_battle_timestamp.timestamp()
+
+  return {
+      "rows": snapshot.rows,
+      "updated_at": snapshot.updated_at.timestamp(),
+      "last_battle_timestamp": last_battle_timestamp,
+      "last_battle_id": snapshot.last_battle_id,
+  }
+
+
+def _snapshot_from_dict(data: dict) -> LeaderboardSnapshot:
+  last_battle_timestamp = None
+  if data["last_battle_timestamp"] is not None:
+    last_battle_timestamp = datetime.fromtimestamp(
+        data["last_battle_timestamp"], timezone.utc)
+
+  return LeaderboardSnapshot(data["rows"],
+                             datetime.fromtimestamp(data["updated_at"]),
+                             last_battle_timestamp, data["last_battle_id"])
+
+
+# Serves the snapshots of the last run until the first refresh replaces them.
+if gr.NO_RELOAD:
+  _snapshots.update(load_snapshots())
+
+
+# Returns the rows of the latest snapshot of the tab. Only if there is none
+# yet, e.g., right after startup, it is computed here.
+def get_leaderboard(tab: LeaderboardTab) -> List[list]:
+  snapshot = _snapshots.get(tab)
+  if snapshot is not None:
+    return snapshot.rows
+
+  with _snapshot_locks[tab]:
+    # Another request may have computed it while this one waited.
+    snapshot = _snapshots.get(tab) or _compute_snapshot(tab)
+  return snapshot.rows
+
+
+# Refreshes the snapshots now and periodically in the background.
+def schedule_leaderboard_refresh():
+  scheduler.add_job(refresh_leaderboards,
+                    "interval",
+                    seconds=LEADERBOARD_UPDATE_INTERVAL,
+                    next_run_time=datetime.now())
+
+
+# How often the language-filtered ratings are materialized.
+MATERIALIZE_INTERVAL = int(os.getenv("MATERIALIZE_INTERVAL", "600"))
+
+# The ratings and pair counts of each language key, which the battles after
+# the cursor of its tab are folded into.
+_materialized_views: Dict[Tuple[LeaderboardTab, str, str | None],
+                          Tuple[Dict[str, float], PairCounts]] = {}
+# The last battle that the views of each tab were folded up to.
+_materialized_cursors: Dict[LeaderboardTab, Tuple[datetime, str]] = {}
+_materialize_lock = threading.Lock()
+
+
+# Returns the indices of the battles of each non-negative key, in their
+# original order.
+def _group_indices(keys: np.ndarray) -> Dict[int, np.ndarray]:
+  indices = np.flatnonzero(keys >= 0)
+  # A stable sort keeps the battles of each key in chronological order.
+  indices = indices[np.argsort(keys[indices], kind="stable")]
+  unique_keys, starts = np.unique(keys[indices], return_index=True)
+  return dict(zip(unique_keys.tolist(), np.split(indices, starts[1:])))
+
+
+# Returns the indices of the battles of each (source language, target
+# language) key that the language filters of the tab can select.
+def group_by_language(
+    tab: LeaderboardTab,
+    battles: db.BattleColumns) -> Dict[Tuple[str, str | None], np.ndarray]:
+  languages = battles.languages
+  source = battles.source_language.astype(np.int32)
+  target = battles.target_language.astype(np.int32)
+
+  if tab == LeaderboardTab.SUMMARIZATION:
+    return {
+        (languages[key], None): indices
+        for key, indices in _group_indices(source).items()
+    }
+
+  groups = {}
+  for key, indices in _group_indices(source).items():
+    groups[(languages[key], ANY_LANGUAGE)] = indices
+  for key, indices in _group_indices(target).items():
+    groups[(ANY_LANGUAGE, languages[key])] = indices
+
+  num_languages = len(languages)
+  pair_keys = np.where((source >= 0) & (target >= 0),
+                       source * num_languages + target, -1)
+  for key, indices in _group_indices(pair_keys).items():
+    source_index, target_index = divmod(key, num_languages)
+    groups[(languages[source_index], languages[target_index])] = indices
+  return groups
+
+
+# Returns the stored view of the key if it already holds its `num_battles`
+# battles. As battles are only ever added, it then needs no recomputation.
+def _load_materialized_view(
+    tab: LeaderboardTab, source_lang: str, target_lang: str | None,
+    num_battles: int) -> Tuple[Dict[str, float], PairCounts] | None:
+  checkpoint = db.get_rating_checkpoint(CATEGORIES[tab],
+                                        RATING_ENGINES[tab].value, source_lang,
+                                        target_lang)
+  if checkpoint is None:
+    return None
+
+  counts = PairCounts.from_dicts(checkpoint.wins, checkpoint.ties)
+  # Each battle is counted for both of its models.
+  if sum(counts.num_battles().values()) != 2 * num_battles:
+    return None
+  return dict(checkpoint.ratings), counts
+
+
+# Stores the ratings of every language filter with battles, along with a
+# checkpoint that holds the pair counts. The first run of the process scans
+# the battle history once and reuses the stored checkpoints that are up to
+# date. Later runs fold only the battles after the cursor of the tab into the
+# keys they belong to. The ratings over all languages are left to
+# `compute_leaderboard`.
+def materialize_ratings(tab: LeaderboardTab):
+  start = time.perf_counter()
+  category = CATEGORIES[tab]
+  engine = RATING_ENGINES[tab]
+  cursor = _materialized_cursors.get(tab)
+
+  battles = get_battle_columns(category,
+                               None,
+                               None,
+                               after=cursor,
+                               with_languages=True)
+  if not battles:
+    return
+
+  groups = group_by_language(tab, battles)
+  num_written = 0
+  for (source_lang, target_lang), indices in groups.items():
+    key = (tab, source_lang, target_lang)
+    view = _materialized_views.get(key)
+    if view is None and cursor is None:
+      view = _load_materialized_view(tab, source_lang, target_lang,
+                                     len(indices))
+      if view is not None:
+        _materialized_views[key] = view
+        continue
+
+    ratings, counts = view or ({}, PairCounts.empty())
+    group = battles.take(indices)
+    counts.add_arrays(group.models, group.model_a, group.model_b, group.winner)
+    if engine == RatingEngine.ELO:
+      update_elo_columns(ratings, group)
+    else:
+      ratings = fit_bradley_terry(counts)
+    _materialized_views[key] = (ratings, counts)
+
+    db.set_ratings(category, [
+        db.Rating(model, rating)
+        for model, rating in round_ratings(ratings).items()
+    ], source_lang, target_lang)
+    # Every battle of the key up to the last battle of the scan is folded
+    # in, so the checkpoint can resume from there.
+    db.set_rating_checkpoint(
+        category, engine.value,
+        db.RatingCheckpoint(ratings, *counts.to_dicts(), battles.last_timestamp,
+                            battles.last_battle_id), source_lang, target_lang)
+    num_written += 1
+
+  _materialized_cursors[tab] = (battles.last_timestamp, battles.last_battle_id)
+  logger.info(
+      "Materialized the ratings of %d %s language filters from %d battles "
+      "in %.2fs, %d of which changed.", len(groups), tab.value, len(battles),
+      time.perf_counter() - start, num_written)
+
+
+def materialize_all_ratings():
+  # Skips the run if the previous one is still going.
+  if not _materialize_lock.acquire(blocking=False):
+    return
+
+  try:
+    for tab in LeaderboardTab:
+      materialize_ratings(tab)
+  finally:
+    _materialize_lock.release()
+
+
+# Materializes the ratings now and periodically in the background.
+def schedule_ratings_materialization():
+  scheduler.add_job(materialize_all_ratings,
+                    "interval",
+                    seconds=MATERIALIZE_INTERVAL,
+                    next_run_time=datetime.now())
+
+
+# Reads the ratings stored by `materialize_ratings` instead of computing them
+# on the request path.
+def load_filtered_ratings(tab: LeaderboardTab, source_lang: str,
+                          target_lang: str | None) -> List[list]:
+  category = CATEGORIES[tab]
+  ratings = db.get_ratings(category, source_lang, target_lang)
+  if not ratings:
+    return []
+
+  checkpoint = db.get_rating_checkpoint(category, RATING_ENGINES[tab].value,
+                                        source_lang, target_lang)
+  num_battles = PairCounts.from_dicts(
+      checkpoint.wins, checkpoint.ties).num_battles() if checkpoint else {}
+  return build_rating_rows({rating.model: rating.rating for rating in ratings},
+                           None, num_battles)
+
+
+# Returns the rows of the leaderboard of the tab over all languages in the
+# columns of the filtered leaderboards.
+def get_unfiltered_rows(tab: LeaderboardTab) -> List[list]:
+  return [row[:3] + row[4:] for row in get_leaderboard(tab)]
+
 
-def update_filtered_leaderboard(tab: str, source_lang: str,
+def update_filtered_leaderboard(tab: LeaderboardTab, source_lang: str,
                                 target_lang: str | None):
-  new_value = load_elo_ratings(tab, source_lang, target_lang)
+  if source_lang == ANY_LANGUAGE and target_lang in (None, ANY_LANGUAGE):
+    new_value = get_unfiltered_rows(tab)
+  else:
+    new_value = load_filtered_ratings(tab, source_lang, target_lang)
   return gr.update(value=new_value)
 
 
@@ -113,18 +536,16 @@ def build_leaderboard():
                                      interactive=True)
 
       filtered_summarization = gr.DataFrame(
-          headers=["Rank", "Model", "Elo rating"],
-          datatype=["number", "str", "number"],
-          value=lambda: load_elo_ratings(LeaderboardTab.SUMMARIZATION,
-                                         ANY_LANGUAGE, None),
+          headers=FILTERED_LEADERBOARD_HEADERS[LeaderboardTab.SUMMARIZATION],
+          datatype=FILTERED_LEADERBOARD_DATATYPES,
+          value=lambda: get_unfiltered_rows(LeaderboardTab.SUMMARIZATION),
           elem_classes="leaderboard",
           visible=False)
 
       original_summarization = gr.Dataframe(
-          headers=["Rank", "Model", "Elo rating"],
-          datatype=["number", "str", "number"],
-          value=lambda: load_elo_ratings(LeaderboardTab.SUMMARIZATION,
-                                         ANY_LANGUAGE, None),
+          headers=LEADERBOARD_HEADERS[LeaderboardTab.SUMMARIZATION],
+          datatype=LEADERBOARD_DATATYPES,
+          value=lambda: get_leaderboard(LeaderboardTab.SUMMARIZATION),
           every=LEADERBOARD_UPDATE_INTERVAL,
           elem_classes="leaderboard")
       gr.Markdown(LEADERBOARD_INFO)
@@ -154,18 +575,16 @@ def build_leaderboard():
                                       interactive=True)
 
       filtered_translation = gr.DataFrame(
-          headers=["Rank", "Model", "Elo rating"],
-          datatype=["number", "str", "number"],
-          value=lambda: load_elo_ratings(LeaderboardTab.TRANSLATION,
-                                         ANY_LANGUAGE, ANY_LANGUAGE),
+          headers=FILTERED_LEADERBOARD_HEADERS[LeaderboardTab.TRANSLATION],
+          datatype=FILTERED_LEADERBOARD_DATATYPES,
+          value=lambda: get_unfiltered_rows(LeaderboardTab.TRANSLATION),
           elem_classes="leaderboard",
           visible=False)
 
       original_translation = gr.Dataframe(
-          headers=["Rank", "Model", "Elo rating"],
-          datatype=["number", "str", "number"],
-          value=lambda: load_elo_ratings(LeaderboardTab.TRANSLATION,
-                                         ANY_LANGUAGE, ANY_LANGUAGE),
+          headers=LEADERBOARD_HEADERS[LeaderboardTab.TRANSLATION],
+          datatype=LEADERBOARD_DATATYPES,
+          value=lambda: get_leaderboard(LeaderboardTab.TRANSLATION),
           every=LEADERBOARD_UPDATE_INTERVAL,
           elem_classes="leaderboard")
       gr.Markdown(LEADERBOARD_INFO)
@@ -0,0 +1,162 @@
+"""
+This module keeps in-process histograms of the completions of each model and
+gauges of the other components, and renders them in the Prometheus text
+format.
+"""
+
+import bisect
+from dataclasses import dataclass
+from dataclasses import field
+from dataclasses import fields
+import threading
+from typing import Callable, Dict, List, Tuple
+
+LABEL_NAMES = ("model", "provider")
+
+
+# The usage of a completion. A completion that summarizes in chunks or is
+# retried adds the usage of each request.
+@dataclass
+class CompletionStats:
+  wall_time: float = 0.0
+  retries: int = 0
+  prompt_tokens: int = 0
+  completion_tokens: int = 0
+  cost: float = 0.0
+  _lock: threading.Lock = field(default_factory=threading.Lock,
+                                repr=False,
+                                compare=False)
+
+  # Adds the retries, tokens and cost of `other`. The wall time is left to
+  # the caller, as the requests may run concurrently.
+  def add(self, other: "CompletionStats"):
+    with self._lock:
+      self.retries += other.retries
+      self.prompt_tokens += other.prompt_tokens
+      self.completion_tokens += other.completion_tokens
+      self.cost += other.cost
+
+  def to_dict(self) -> dict:
+    return {
+        stats_field.name: getattr(self, stats_field.name)
+        for stats_field in fields(self)
+        if stats_field.name != "_lock"
+    }
+
+
+class Histogram:
+
+  def __init__(self, name: str, description: str, buckets: List[float]):
+    self.name = name
+    self.description = description
+    self.buckets = sorted(buckets)
+    self._lock = threading.Lock()
+    # The bucket counts, sum and count of each label value tuple. The last
+    # bucket is +Inf.
+    self._series: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+  def observe(self, labels: Tuple[str, ...], value: float):
+    index = bisect.bisect_left(self.buckets, value)
+    with self._lock:
+      counts, total, count = self._series.get(
+          labels, ([0] * (len(self.buckets) + 1), 0.0, 0))
+      counts[index] += 1
+      self._series[labels] = (counts, total + value, count + 1)
+
+  def render(self) -> List[str]:
+    with self._lock:
+      series = {
+          labels: (list(counts), total, count)
+          for labels, (counts, total, count) in self._series.items()
+      }
+
+    lines = [
+        f"# HELP {self.name} {self.description}",
+        f"# TYPE {self.name} histogram",
+    ]
+    for labels, (counts, total, count) in sorted(series.items()):
+      label_pairs = [
+          f'{name}="{_escape_label_value(value)}"'
+          for name, value in zip(LABEL_NAMES, labels)
+      ]
+      cumulative_count = 0
+      for bound, bucket_count in zip(self.buckets + [float("inf")], counts):
+        cumulative_count += bucket_count
+        le = "+Inf" if bound == float("inf") else repr(float(bound))
+        bucket_labels = ",".join(label_pairs + [f'le="{le}"'])
+        lines.append(f"{self.name}_bucket{{{bucket_labels}}} "
+                     f"{cumulative_count}")
+      lines.append(f"{self.name}_sum{{{','.join(label_pairs)}}} {total}")
+      lines.append(f"{self.name}_count{{{','.join(label_pairs)}}} {count}")
+    return lines
+
+
+# A value that is read when the metrics are rendered.
+class Gauge:
+
+  def __init__(self, name: str, description: str, read: Callable[[], float]):
+    self.name = name
+    self.description = description
+    self.read = read
+
+  def render(self) -> List[str]:
+    return [
+        f"# HELP {self.name} {self.description}",
+        f"# TYPE {self.name} gauge",
+        f"{self.name} {self.read()}",
+    ]
+
+
+def _escape_label_value(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+COMPLETION_SECONDS = Histogram("arena_completion_seconds",
+                               "Wall time of completions, including retries.",
+                               [0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120])
+COMPLETION_RETRIES = Histogram(
+    "arena_completion_retries",
+    "Requests made again after an invalid response.", [0, 1, 2, 3])
+PROMPT_TOKENS = Histogram("arena_completion_prompt_tokens",
+                          "Prompt tokens of completions, including retries.",
+                          [64, 256, 1024, 4096, 16384, 65536, 262144])
+COMPLETION_TOKENS = Histogram(
+    "arena_completion_completion_tokens",
+    "Completion tokens of completions, including retries.",
+    [16, 64, 256, 1024, 4096, 16384])
+COMPLETION_COST = Histogram("arena_completion_cost_usd",
+                            "Estimated cost of completions in USD.",
+                            [0.00001, 0.0001, 0.001, 0.01, 0.1, 1])
+
+HISTOGRAMS = [
+    COMPLETION_SECONDS,
+    COMPLETION_RETRIES,
+    PROMPT_TOKENS,
+    COMPLETION_TOKENS,
+    COMPLETION_COST,
+]
+
+_gauges: List[Gauge] = []
+
+
+# Registers a gauge whose value is read by `read` on each render.
+def add_gauge(name: str, description: str, read: Callable[[], float]):
+  _gauges.append(Gauge(name, description, read))
+
+
+def record_completion(model_name: str, provider: str, stats: CompletionStats):
+  labels = (model_name, provider)
+  COMPLETION_SECONDS.observe(labels, stats.wall_time)
+  COMPLETION_RETRIES.observe(labels, stats.retries)
+  PROMPT_TOKENS.observe(labels, stats.prompt_tokens)
+  COMPLETION_TOKENS.observe(labels, stats.completion_tokens)
+  COMPLETION_COST.observe(labels, stats.cost)
+
+
+def render_metrics() -> str:
+  lines = []
+  for histogram in HISTOGRAMS:
+    lines += histogram.render()
+  for gauge in _gauges:
+    lines += gauge.render()
+  return "\n".join(lines) + "\n"
@@ -2,20 +2,107 @@
 This module contains functions to interact with the models.
 """
 
+from collections import Counter
+from concurrent import futures
+import contextlib
+import enum
+import functools
 import json
+import logging
+import math
 import os
-from typing import List, Optional, Tuple
+import re
+import tempfile
+import threading
+import time
+from typing import Callable, FrozenSet, List, Optional, Set, Tuple
 
 import litellm
+import tiktoken
+
+from cache import completion_cache
+from cache import get_cache_key
+from health import health_tracker
+from metrics import CompletionStats
+from metrics import record_completion
+from scheduler import scheduler
+import tracing
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
 
 DEFAULT_SUMMARIZE_INSTRUCTION = "Summarize the given text without changing the language of it."  # pylint: disable=line-too-long
 DEFAULT_TRANSLATE_INSTRUCTION = "Translate the given text from {source_lang} to {target_lang}."  # pylint: disable=line-too-long
 
+# Token counts are estimated with the tokenizer of the GPT-4o models. The
+# tokenizers of other providers split text differently, so the estimates are
+# scaled up by TOKEN_COUNT_MARGIN for every model.
+TOKEN_ENCODING = "o200k_base"
+TOKEN_COUNT_MARGIN = float(os.getenv("TOKEN_COUNT_MARGIN", "1.2"))
+# Tokens of the chat template and the output format instructions that are
+# added to each request.
+REQUEST_OVERHEAD_TOKENS = 64
+
+DEFAULT_CONTEXT_WINDOW = 8192
+DEFAULT_MAX_OUTPUT_TOKENS = 4096
+
 
 class ContextWindowExceededError(Exception):
   pass
 
 
+class ParseOutcome(enum.Enum):
+  # The response was in the requested format.
+  STRICT = "strict"
+  # The result was extracted from a malformed or truncated response, which
+  # would have been requested again otherwise.
+  RECOVERED = "recovered"
+  FAILED = "failed"
+
+
+# Counts the parse outcomes of the responses of each model.
+class ParseStats:
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counts: Counter = Counter()
+
+  def record(self, model_name: str, outcome: ParseOutcome):
+    with self._lock:
+      self._counts[(model_name, outcome)] += 1
+
+  # Returns the number of responses per outcome, in total and per model.
+  def stats(self) -> dict:
+    with self._lock:
+      counts = dict(self._counts)
+
+    totals = {outcome.value: 0 for outcome in ParseOutcome}
+    per_model = {}
+    for (model_name, outcome), count in counts.items():
+      totals[outcome.value] += count
+      per_model.setdefault(model_name, {})[outcome.value] = count
+    return {**totals, "models": per_model}
+
+
+parse_stats = ParseStats()
+
+
+def log_parse_stats():
+  stats = parse_stats.stats()
+  logger.info(
+      "Responses: %d parsed, %d recovered without a retry, %d failed to "
+      "parse.", stats[ParseOutcome.STRICT.value],
+      stats[ParseOutcome.RECOVERED.value], stats[ParseOutcome.FAILED.value])
+
+
+scheduler.add_job(log_parse_stats, "interval", seconds=60 * 60)
+
+
+class CompletionTimeoutError(Exception):
+  pass
+
+
 class Model:
 
   def __init__(
@@ -26,6 +113,8 @@ class Model:
       api_base: str = None,
       summarize_instruction: str = None,
       translate_instruction: str = None,
+      context_window: int = DEFAULT_CONTEXT_WINDOW,
+      max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
   ):
     self.name = name
     self.provider = provider
@@ -33,14 +122,188 @@ class Model:
     self.api_base = api_base
     self.summarize_instruction = summarize_instruction or DEFAULT_SUMMARIZE_INSTRUCTION  # pylint: disable=line-too-long
     self.translate_instruction = translate_instruction or DEFAULT_TRANSLATE_INSTRUCTION  # pylint: disable=line-too-long
+    # The tokens of the input and output together, and of the output alone.
+    self.context_window = context_window
+    self.max_output_tokens = max_output_tokens
+
+  # Returns the max_tokens of a request whose input has `input_tokens` tokens
+  # and whose output is expected to take `output_tokens`, or None if the
+  # context window cannot fit both.
+  def get_max_tokens(self, input_tokens: int, output_tokens: int) -> int | None:
+    max_tokens = min(output_tokens, self.max_output_tokens)
+    if input_tokens + max_tokens > self.context_window:
+      return None
+    return max_tokens
 
   # Returns the parsed result or raw response, and whether parsing succeeded.
+  # If `on_partial` is given, the response is streamed and `on_partial` is
+  # called with the partial result whenever it grows.
+  # If `deadline`, a `time.monotonic()` value, is given, the call is abandoned
+  # with CompletionTimeoutError once it passes, including any retries.
+  # The usage of the call is recorded in the metrics and added to `stats` if
+  # given. Cached results have no usage. If `use_cache` is False, the result
+  # is neither read from nor written to the completion cache.
   def completion(self,
                  instruction: str,
                  prompt: str,
-                 max_tokens: Optional[float] = None,
-                 max_retries: int = 2) -> Tuple[str, bool]:
-    messages = [{
+                 max_tokens: Optional[int] = None,
+                 max_retries: int = 2,
+                 on_partial: Optional[Callable[[str], None]] = None,
+                 deadline: Optional[float] = None,
+                 stats: Optional[CompletionStats] = None,
+                 use_cache: bool = True) -> Tuple[str, bool]:
+    cache_key = None
+    if use_cache and completion_cache.enabled:
+      cache_key = get_cache_key(self.name, instruction, prompt, max_tokens)
+      cached_result = completion_cache.get(cache_key)
+      if cached_result is not None:
+        if on_partial:
+          on_partial(cached_result)
+        return cached_result, True
+
+    messages = self._get_messages(instruction, prompt)
+    start = time.perf_counter()
+    call_stats = CompletionStats()
+
+    for attempt in range(max_retries + 1):
+      call_stats.retries = attempt
+      try:
+        with tracing.span("completion_attempt",
+                          model=self.name,
+                          attempt=attempt):
+          with health_tracker.track(
+              self.name,
+              self.get_provider(),
+              ignored_exceptions=(litellm.ContextWindowExceededError,)):
+            response = self._request(messages, max_tokens, on_partial, deadline,
+                                     call_stats)
+      except litellm.ContextWindowExceededError as e:
+        raise ContextWindowExceededError() from e
+      except litellm.Timeout as e:
+        raise CompletionTimeoutError() from e
+
+      result, is_valid = self._parse_response(response)
+      is_recovered = False
+      if is_valid:
+        parse_stats.record(self.name, ParseOutcome.STRICT)
+      else:
+        # Most malformed responses only have a code fence around them or were
+        # cut off, which another request would not fix.
+        extracted_result = self._extract_result(response)
+        if extracted_result is not None:
+          result, is_valid, is_recovered = extracted_result, True, True
+          parse_stats.record(self.name, ParseOutcome.RECOVERED)
+        else:
+          parse_stats.record(self.name, ParseOutcome.FAILED)
+
+      if not is_valid and attempt < max_retries:
+        continue
+
+      call_stats.wall_time = time.perf_counter() - start
+      call_stats.cost = self._estimate_cost(call_stats.prompt_tokens,
+                                            call_stats.completion_tokens)
+      record_completion(self.name, self.get_provider(), call_stats)
+      if stats is not None:
+        stats.add(call_stats)
+
+      # Only valid results are cached, so that an invalid one can be retried.
+      # Recovered results may be incomplete, so they are shown but not cached.
+      if is_valid and not is_recovered and cache_key:
+        completion_cache.put(cache_key, result, call_stats.wall_time,
+                             call_stats.cost)
+      return result, is_valid
+
+  def get_litellm_model(self) -> str:
+    return self.provider + "/" + self.name if self.provider else self.name
+
+  def get_provider(self) -> str:
+    if self.provider:
+      return self.provider
+
+    try:
+      _, provider, _, _ = litellm.get_llm_provider(self.name)
+      return provider
+    except litellm.BadRequestError:
+      return self.name
+
+  # Returns the response and adds its tokens to `stats`.
+  def _request(self, messages: List[dict], max_tokens: Optional[int],
+               on_partial: Optional[Callable[[str], None]],
+               deadline: Optional[float], stats: CompletionStats) -> str:
+    kwargs = {
+        "model": self.get_litellm_model(),
+        "api_key": self.api_key,
+        "api_base": self.api_base,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        **self._get_completion_kwargs()
+    }
+    if deadline is not None:
+      kwargs["timeout"] = get_remaining_time(deadline)
+
+    if on_partial is None:
+      response = litellm.completion(**kwargs)
+      stats.prompt_tokens += response.usage.prompt_tokens
+      stats.completion_tokens += response.usage.completion_tokens
+      return response.choices[0].message.content
+
+    # Asks for the usage in the last chunk where the provider supports it.
+    if self._supports_stream_usage():
+      kwargs["stream_options"] = {"include_usage": True}
+
+    result_stream = self._create_result_stream()
+    response = ""
+    usage = None
+    for chunk in litellm.completion(**kwargs, stream=True):
+      # The timeout of litellm only bounds the wait for each chunk, so a slow
+      # stream is stopped here.
+      if deadline is not None:
+        get_remaining_time(deadline)
+
+      usage = getattr(chunk, "usage", None) or usage
+      # The chunk with the usage may have no choices.
+      if not chunk.choices:
+        continue
+
+      delta = chunk.choices[0].delta.content
+      if not delta:
+        continue
+
+      response += delta
+      partial_result = result_stream.feed(delta)
+      if partial_result is not None:
+        on_partial(partial_result)
+
+    # The tokens are estimated only if the provider sent no usage.
+    if usage is not None:
+      stats.prompt_tokens += usage.prompt_tokens
+      stats.completion_tokens += usage.completion_tokens
+    else:
+      stats.prompt_tokens += sum(
+          count_tokens(message["content"]) for message in messages)
+      stats.completion_tokens += count_tokens(response)
+    return response
+
+  def _supports_stream_usage(self) -> bool:
+    supported_params = litellm.get_supported_openai_params(
+        model=self.name, custom_llm_provider=self.get_provider())
+    return "stream_options" in (supported_params or [])
+
+  # Returns the estimated cost of a call in USD, or 0 if the model's pricing
+  # is unknown.
+  def _estimate_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+    try:
+      prompt_cost, completion_cost = litellm.cost_per_token(
+          model=self.get_litellm_model(),
+          prompt_tokens=prompt_tokens,
+          completion_tokens=completion_tokens)
+      return prompt_cost + completion_cost
+    # litellm raises various exceptions for models without pricing.
+    except Exception:  # pylint: disable=broad-except
+      return 0.0
+
+  def _get_messages(self, instruction: str, prompt: str) -> List[dict]:
+    return [{
         "role":
             "system",
         "content":
@@ -52,25 +315,34 @@ Output following this JSON format without using code blocks:
         "content": prompt
     }]
 
-    for attempt in range(max_retries + 1):
-      try:
-        response = litellm.completion(model=self.provider + "/" +
-                                      self.name if self.provider else self.name,
-                                      api_key=self.api_key,
-                                      api_base=self.api_base,
-                                      messages=messages,
-                                      max_tokens=max_tokens,
-                                      **self._get_completion_kwargs())
-
-        json_response = response.choices[0].message.content
-        parsed_json = json.loads(json_response)
-        return parsed_json["result"], True
+  # Returns the parsed result or raw response, and whether parsing succeeded.
+  def _parse_response(self, response: str) -> Tuple[str, bool]:
+    try:
+      parsed_json = json.loads(response)
+      return parsed_json["result"], True
+    except (json.JSONDecodeError, KeyError, TypeError):
+      return response, False
 
-      except litellm.ContextWindowExceededError as e:
-        raise ContextWindowExceededError() from e
-      except json.JSONDecodeError:
-        if attempt == max_retries:
-          return json_response, False
+  # Returns the result extracted from a response that failed to parse, or
+  # None if there is none.
+  def _extract_result(self, response: str) -> str | None:
+    response = strip_code_fence(response)
+    try:
+      result = json.loads(response)["result"]
+      if isinstance(result, str):
+        return result
+    except (json.JSONDecodeError, KeyError, TypeError):
+      pass
+
+    # Salvages the value of a truncated response, e.g., cut off by max_tokens,
+    # or one with trailing text.
+    try:
+      return JsonResultStream().feed(response)
+    except json.JSONDecodeError:
+      return None
+
+  def _create_result_stream(self) -> "JsonResultStream":
+    return JsonResultStream()
 
   def _get_completion_kwargs(self):
     return {
@@ -81,56 +353,217 @@ Output following this JSON format without using code blocks:
     }
 
 
+CODE_FENCE = re.compile(r"^\s*```[\w-]*[ \t]*\n?(.*?)(?:\n?```)?\s*$",
+                        re.DOTALL)
+
+
+# Returns the response without the code block around it, whose closing fence
+# may be missing if the response was cut off.
+def strip_code_fence(response: str) -> str:
+  match = CODE_FENCE.match(response)
+  return match.group(1) if match else response
+
+
+@functools.cache
+def _get_encoding() -> tiktoken.Encoding:
+  return tiktoken.get_encoding(TOKEN_ENCODING)
+
+
+def count_tokens(text: str) -> int:
+  return len(_get_encoding().encode(text, disallowed_special=()))
+
+
+# Returns the estimated input tokens of a request with the given instruction
+# and a prompt of `prompt_tokens` tokens, for any of the models.
+def estimate_input_tokens(instruction: str, prompt_tokens: int) -> int:
+  tokens = count_tokens(instruction) + prompt_tokens + REQUEST_OVERHEAD_TOKENS
+  return math.ceil(tokens * TOKEN_COUNT_MARGIN)
+
+
+# Returns the seconds left until the deadline, or raises CompletionTimeoutError
+# if it has passed.
+def get_remaining_time(deadline: float) -> float:
+  remaining_time = deadline - time.monotonic()
+  if remaining_time <= 0:
+    raise CompletionTimeoutError()
+  return remaining_time
+
+
+# Ref: https://docs.anthropic.com/en/docs/test-and-evaluate/strengthen-guardrails/increase-consistency#prefill-claudes-response # pylint: disable=line-too-long
+ANTHROPIC_RESULT_PREFIX = "<result>"
+ANTHROPIC_RESULT_SUFFIX = "</result>"
+
+
 class AnthropicModel(Model):
 
-  def completion(self,
-                 instruction: str,
-                 prompt: str,
-                 max_tokens: Optional[float] = None,
-                 max_retries: int = 2) -> Tuple[str, bool]:
-    # Ref: https://docs.anthropic.com/en/docs/test-and-evaluate/strengthen-guardrails/increase-consistency#prefill-claudes-response # pylint: disable=line-too-long
-    prefix = "<result>"
-    suffix = "</result>"
-    messages = [{
+  def _get_messages(self, instruction: str, prompt: str) -> List[dict]:
+    return [{
         "role":
             "user",
         "content":
             f"""{instruction}
 Output following this format:
-{prefix}...{suffix}
+{ANTHROPIC_RESULT_PREFIX}...{ANTHROPIC_RESULT_SUFFIX}
 Text:
 {prompt}"""
     }, {
         "role": "assistant",
-        "content": prefix
+        "content": ANTHROPIC_RESULT_PREFIX
     }]
 
-    for attempt in range(max_retries + 1):
-      try:
-        response = litellm.completion(
-            model=self.provider + "/" +
-            self.name if self.provider else self.name,
-            api_key=self.api_key,
-            api_base=self.api_base,
-            messages=messages,
-            max_tokens=max_tokens,
-        )
+  def _parse_response(self, response: str) -> Tuple[str, bool]:
+    stripped_response = response.rstrip()
+    if stripped_response.endswith(ANTHROPIC_RESULT_SUFFIX):
+      return stripped_response.removesuffix(
+          ANTHROPIC_RESULT_SUFFIX).strip(), True
 
-      except litellm.ContextWindowExceededError as e:
-        raise ContextWindowExceededError() from e
+    return response, False
+
+  # Only a response with the closing tag is complete. A response cut off by
+  # max_tokens or ended by the model before closing the tag has none.
+  def _extract_result(self, response: str) -> str | None:
+    result, suffix, _ = strip_code_fence(response).partition(
+        ANTHROPIC_RESULT_SUFFIX)
+    if not suffix:
+      return None
+
+    result = result.strip().removeprefix(ANTHROPIC_RESULT_PREFIX).strip()
+    return result or None
+
+  def _create_result_stream(self) -> "TaggedResultStream":
+    return TaggedResultStream()
+
+  # No stop sequence is set, as litellm does not tell whether a response was
+  # ended by it or by the model. The closing tag the model writes tells
+  # whether the result is complete.
+  def _get_completion_kwargs(self):
+    return {}
+
+
+# The first two hex digits of high surrogates, U+D800 to U+DBFF.
+HIGH_SURROGATES = ("d8", "d9", "da", "db")
+
+
+# Incrementally decodes the value of "result" from a streamed JSON response.
+class JsonResultStream:
+
+  _ESCAPES = {
+      "b": "\b",
+      "f": "\f",
+      "n": "\n",
+      "r": "\r",
+      "t": "\t",
+  }
+
+  def __init__(self):
+    self._response = ""
+    # The index of the next character of the value to decode. None until the
+    # value starts.
+    self._index = None
+    self._result = ""
+    self._finished = False
+
+  # Returns the result decoded so far, or None if it has not changed.
+  def feed(self, delta: str) -> str | None:
+    self._response += delta
+    if self._finished:
+      return None
+
+    if self._index is None:
+      match = re.search(r'"result"\s*:\s*"', self._response)
+      if match is None:
+        return None
+      self._index = match.end()
+
+    decoded = []
+    response = self._response
+    index = self._index
+    while index < len(response):
+      char = response[index]
+      if char == '"':
+        self._finished = True
+        break
+
+      if char != "\\":
+        decoded.append(char)
+        index += 1
+        continue
 
-      result = response.choices[0].message.content
-      if result.endswith(suffix):
-        return result.removesuffix(suffix).strip(), True
+      # Waits for the rest of an incomplete escape sequence.
+      if index + 1 >= len(response):
+        break
+      escaped = response[index + 1]
+      if escaped == "u":
+        if index + 6 > len(response):
+          break
+        # A character outside the BMP is escaped as a surrogate pair.
+        length = 6
+        if response[index + 2:index + 4].lower() in HIGH_SURROGATES:
+          following = response[index + 6:index + 8]
+          # Waits to see whether the low surrogate follows.
+          if following in ("", "\\"):
+            break
+          if following == "\\u":
+            length = 12
+        if index + length > len(response):
+          break
+        try:
+          value = json.loads(f'"{response[index:index + length]}"')
+        except json.JSONDecodeError:
+          value = None
+        # An invalid escape or an unpaired surrogate is replaced, and only
+        # its first escape is consumed.
+        if value is None or len(value) != 1 or "\ud800" <= value <= "\udfff":
+          decoded.append("\ufffd")
+          index += 6
+          continue
 
-      if attempt == max_retries:
-        return result, False
+        decoded.append(value)
+        index += length
+        continue
+
+      decoded.append(self._ESCAPES.get(escaped, escaped))
+      index += 2
+
+    self._index = index
+    if not decoded:
+      return None
+
+    self._result += "".join(decoded)
+    return self._result
+
+
+# Returns the streamed text between the result tags of an Anthropic response,
+# whose prefix is prefilled.
+class TaggedResultStream:
+
+  def __init__(self):
+    self._response = ""
+    self._result = None
+
+  # Returns the result received so far, or None if it has not changed.
+  def feed(self, delta: str) -> str | None:
+    self._response += delta
+
+    result = self._response.split(ANTHROPIC_RESULT_SUFFIX, 1)[0]
+    # Holds back a partially received suffix.
+    for length in range(len(ANTHROPIC_RESULT_SUFFIX) - 1, 0, -1):
+      if result.endswith(ANTHROPIC_RESULT_SUFFIX[:length]):
+        result = result[:-length]
+        break
+
+    result = result.lstrip()
+    if result == self._result:
+      return None
+
+    self._result = result
+    return result
 
 
 class VertexModel(Model):
 
-  def __init__(self, name: str, vertex_credentials: str):
-    super().__init__(name, provider="vertex_ai")
+  def __init__(self, name: str, vertex_credentials: str, **kwargs):
+    super().__init__(name, provider="vertex_ai", **kwargs)
     self.vertex_credentials = vertex_credentials
 
   def _get_completion_kwargs(self):
@@ -142,36 +575,167 @@ class VertexModel(Model):
     }
 
 
+# The context windows are those the providers serve the models with.
 supported_models: List[Model] = [
-    Model("gpt-4o-2024-11-20"),
-    Model("gpt-4o-mini-2024-07-18"),
-    AnthropicModel("claude-3-5-sonnet-20241022"),
-    AnthropicModel("claude-3-5-haiku-20241022"),
+    Model("gpt-4o-2024-11-20", context_window=128_000,
+          max_output_tokens=16_384),
+    Model("gpt-4o-mini-2024-07-18",
+          context_window=128_000,
+          max_output_tokens=16_384),
+    AnthropicModel("claude-3-5-sonnet-20241022",
+                   context_window=200_000,
+                   max_output_tokens=8192),
+    AnthropicModel("claude-3-5-haiku-20241022",
+                   context_window=200_000,
+                   max_output_tokens=8192),
     VertexModel("gemini-1.5-pro-002",
-                vertex_credentials=os.getenv("VERTEX_CREDENTIALS")),
+                vertex_credentials=os.getenv("VERTEX_CREDENTIALS"),
+                context_window=2_097_152,
+                max_output_tokens=8192),
     VertexModel("gemini-1.5-flash-002",
-                vertex_credentials=os.getenv("VERTEX_CREDENTIALS")),
-    Model("google/gemma-2-9b-it", provider="deepinfra"),
-    Model("google/gemma-2-27b-it", provider="deepinfra"),
-    Model("meta-llama/Meta-Llama-3.1-8B-Instruct", provider="deepinfra"),
-    Model("meta-llama/Meta-Llama-3.1-70B-Instruct", provider="deepinfra"),
-    Model("meta-llama/Meta-Llama-3.1-405B-Instruct", provider="deepinfra"),
-    Model("meta-llama/Llama-3.2-3B-Instruct", provider="deepinfra"),
-    Model("meta-llama/Llama-3.2-1B-Instruct", provider="deepinfra"),
-    Model("Qwen/Qwen2.5-72B-Instruct", provider="deepinfra"),
+                vertex_credentials=os.getenv("VERTEX_CREDENTIALS"),
+                context_window=1_048_576,
+                max_output_tokens=8192),
+    Model("google/gemma-2-9b-it", provider="deepinfra", context_window=8192),
+    Model("google/gemma-2-27b-it", provider="deepinfra", context_window=8192),
+    Model("meta-llama/Meta-Llama-3.1-8B-Instruct",
+          provider="deepinfra",
+          context_window=131_072),
+    Model("meta-llama/Meta-Llama-3.1-70B-Instruct",
+          provider="deepinfra",
+          context_window=131_072),
+    Model("meta-llama/Meta-Llama-3.1-405B-Instruct",
+          provider="deepinfra",
+          context_window=32_768),
+    Model("meta-llama/Llama-3.2-3B-Instruct",
+          provider="deepinfra",
+          context_window=131_072),
+    Model("meta-llama/Llama-3.2-1B-Instruct",
+          provider="deepinfra",
+          context_window=131_072),
+    Model("Qwen/Qwen2.5-72B-Instruct",
+          provider="deepinfra",
+          context_window=32_768),
 ]
 
+# Models that fail a health check are excluded from battles until they pass
+# the next one.
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "30"))
+HEALTH_CHECK_INTERVAL = int(os.getenv("HEALTH_CHECK_INTERVAL", "600"))
+# Health check results are cached in this file, so that a restart within the
+# TTL does not check the models again.
+HEALTH_CACHE_PATH = os.getenv("HEALTH_CACHE_PATH", ".model_health.json")
+HEALTH_CACHE_TTL = int(os.getenv("HEALTH_CACHE_TTL", "600"))
 
-def check_models(models: List[Model]):
-  for model in models:
-    print(f"Checking model {model.name}...")
+_unavailable_models: FrozenSet[str] = frozenset()
+
+
+# Returns the models that passed the last health check and whose circuits
+# are not open.
+def get_available_models() -> List[Model]:
+  return [
+      model for model in supported_models
+      if model.name not in _unavailable_models and
+      health_tracker.is_available(model.name, model.get_provider())
+  ]
+
+
+# The cache is bypassed, so that the provider is actually reached.
+def check_model(model: Model):
+  model.completion(
+      """Output following this JSON format without using code blocks:
+{"result": "your result here"}""",
+      "How are you?",
+      use_cache=False)
+
+
+# Returns None if the cache is missing, stale or malformed.
+def _load_health_cache(models: List[Model]) -> Set[str] | None:
+  try:
+    with open(HEALTH_CACHE_PATH, "r", encoding="utf-8") as cache_file:
+      cache = json.load(cache_file)
+    checked_at = float(cache["checked_at"])
+    availability = dict(cache["availability"])
+  except (OSError, KeyError, TypeError, ValueError):
+    return None
+
+  if time.time() - checked_at > HEALTH_CACHE_TTL:
+    return None
+  if set(availability) != {model.name for model in models}:
+    return None
+
+  return {name for name, available in availability.items() if not available}
+
+
+def _save_health_cache(models: List[Model], unavailable: Set[str]):
+  cache = {
+      "checked_at": time.time(),
+      "availability": {
+          model.name: model.name not in unavailable for model in models
+      }
+  }
+  # The file is written in full before it replaces the old one, so that
+  # another server process does not read a partial file.
+  temp_path = None
+  try:
+    with tempfile.NamedTemporaryFile(
+        "w",
+        encoding="utf-8",
+        dir=os.path.dirname(HEALTH_CACHE_PATH) or ".",
+        prefix=os.path.basename(HEALTH_CACHE_PATH) + ".",
+        suffix=".tmp",
+        delete=False) as cache_file:
+      temp_path = cache_file.name
+      json.dump(cache, cache_file)
+    os.replace(temp_path, HEALTH_CACHE_PATH)
+  except OSError:
+    logger.exception("Failed to save the health check results.")
+    if temp_path is not None:
+      with contextlib.suppress(OSError):
+        os.remove(temp_path)
+
+
+# Checks the models concurrently and marks the ones that fail or do not
+# respond within the timeout as unavailable.
+def check_models(models: List[Model], use_cache: bool = True):
+  # pylint: disable=global-statement
+  global _unavailable_models
+
+  unavailable = _load_health_cache(models) if use_cache else None
+  if unavailable is not None:
+    logger.info("Using cached health check results.")
+  else:
+    executor = futures.ThreadPoolExecutor(max_workers=len(models))
     try:
-      model.completion(
-          """Output following this JSON format without using code blocks:
-{"result": "your result here"}""", "How are you?")
-      print(f"Model {model.name} is available.")
-
-    # This check is designed to verify the availability of the models
-    # without any issues. Therefore, we need to catch all exceptions.
-    except Exception as e:  # pylint: disable=broad-except
-      raise RuntimeError(f"Model {model.name} is not available: {e}") from e
+      tasks = {executor.submit(check_model, model): model for model in models}
+      done, _ = futures.wait(tasks, timeout=HEALTH_CHECK_TIMEOUT)
+    finally:
+      executor.shutdown(wait=False, cancel_futures=True)
+
+    unavailable = set()
+    for task, model in tasks.items():
+      if task not in done:
+        logger.error("Model %s did not respond in %ss.", model.name,
+                     HEALTH_CHECK_TIMEOUT)
+        unavailable.add(model.name)
+      elif task.exception():
+        logger.error("Model %s is not available: %s", model.name,
+                     task.exception())
+        unavailable.add(model.name)
+
+    _save_health_cache(models, unavailable)
+
+  for model in models:
+    if model.name not in unavailable:
+      logger.info("Model %s is available.", model.name)
+
+  _unavailable_models = frozenset(unavailable)
+
+
+# Checks the models periodically in the background.
+def schedule_model_checks(models: List[Model]):
+  scheduler.add_job(check_models,
+                    "interval",
+                    seconds=HEALTH_CHECK_INTERVAL,
+                    args=[models],
+                    kwargs={"use_cache": False})
@@ -2,22 +2,26 @@
 This module contains functions for rate limiting requests.
 
 The rate limiting system operates on two levels:
-1. User-level rate limiting: Each user (identified by a token) has a
-   configurable minimum interval between requests.
+1. User-level rate limiting: Each user (identified by a token) has a token
+   bucket that refills at a configurable interval between requests.
 
 2. System-wide rate limiting: There is a global limit on the total number of 
-   requests across all users within a specified time period.
+   requests across all users within a sliding window of a specified period.
 """
 
-from datetime import datetime
-import signal
-import sys
-from typing import Dict
+import abc
+from collections import deque
+from collections import OrderedDict
+import os
+import threading
+import time
+from typing import Callable, Deque, Tuple
 from uuid import uuid4
 
-from apscheduler.schedulers import background
 import gradio as gr
 
+from sqlite_connection import ThreadLocalConnection
+
 
 class InvalidTokenException(Exception):
   pass
@@ -31,58 +35,208 @@ class SystemRateLimitException(Exception):
   pass
 
 
-class RateLimiter:
+# (The number of requests available, the last time the token was used).
+Bucket = Tuple[float, float]
+
+
+# Stores the token buckets and request times, so that processes sharing a
+# backend share the limits.
+class RateLimiterBackend(abc.ABC):
+
+  @abc.abstractmethod
+  def set_bucket(self, token: str, bucket: Bucket):
+    pass
+
+  @abc.abstractmethod
+  def token_exists(self, token: str) -> bool:
+    pass
+
+  # Atomically removes the tokens unused since `expired_before` and calls
+  # `check` with the bucket of the token (None if it does not exist) and the
+  # number of requests made since `window_start`. Unless `check` raises, the
+  # bucket it returns is stored and a request made at `now` is recorded.
+  @abc.abstractmethod
+  def acquire(self, token: str, now: float, window_start: float,
+              expired_before: float, check: Callable[[Bucket | None, int],
+                                                     Bucket]):
+    pass
+
+
+class InMemoryBackend(RateLimiterBackend):
+
+  def __init__(self):
+    # Maps tokens to their buckets, ordered by the last time the token was
+    # used, so that expired tokens are removed from the front.
+    self.buckets: OrderedDict[str, Bucket] = OrderedDict()
+
+    # The times of the requests made within the last period.
+    self.request_times: Deque[float] = deque()
+
+    # Gradio runs the handlers on a thread pool.
+    self._lock = threading.Lock()
+
+  def set_bucket(self, token: str, bucket: Bucket):
+    with self._lock:
+      self.buckets[token] = bucket
+      self.buckets.move_to_end(token)
+
+  def token_exists(self, token: str) -> bool:
+    with self._lock:
+      return token in self.buckets
+
+  def acquire(self, token: str, now: float, window_start: float,
+              expired_before: float, check: Callable[[Bucket | None, int],
+                                                     Bucket]):
+    with self._lock:
+      while self.buckets:
+        oldest_token, (_, used_at) = next(iter(self.buckets.items()))
+        if used_at >= expired_before:
+          break
+        del self.buckets[oldest_token]
+
+      while self.request_times and self.request_times[0] <= window_start:
+        self.request_times.popleft()
+
+      bucket = check(self.buckets.get(token), len(self.request_times))
+
+      self.buckets[token] = bucket
+      self.buckets.move_to_end(token)
+      self.request_times.append(now)
+
+
+# Stores the state in a SQLite database, so that it is shared by the server
+# processes on the same machine.
+class SqliteBackend(RateLimiterBackend):
+
+  def __init__(self, path: str):
+    self.path = path
+    # Transactions are managed explicitly in `acquire`.
+    self._connection = ThreadLocalConnection(path)
+
+    with self._connection.get() as connection:
+      connection.executescript("""
+        CREATE TABLE IF NOT EXISTS buckets (
+          token TEXT PRIMARY KEY,
+          available REAL NOT NULL,
+          used_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS buckets_used_at ON buckets (used_at);
+        CREATE TABLE IF NOT EXISTS requests (time REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS requests_time ON requests (time);
+      """)
+
+  def set_bucket(self, token: str, bucket: Bucket):
+    with self._connection.get() as connection:
+      connection.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                         (token, *bucket))
+
+  def token_exists(self, token: str) -> bool:
+    with self._connection.get() as connection:
+      return connection.execute("SELECT 1 FROM buckets WHERE token = ?",
+                                (token,)).fetchone() is not None
+
+  def acquire(self, token: str, now: float, window_start: float,
+              expired_before: float, check: Callable[[Bucket | None, int],
+                                                     Bucket]):
+    connection = self._connection.get()
+    # Locks the database for writing, so that the check and the update are
+    # atomic across processes.
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+      connection.execute("DELETE FROM buckets WHERE used_at < ?",
+                         (expired_before,))
+      connection.execute("DELETE FROM requests WHERE time <= ?",
+                         (window_start,))
+      bucket = connection.execute(
+          "SELECT available, used_at FROM buckets WHERE token = ?",
+          (token,)).fetchone()
+      (request_count,
+      ) = connection.execute("SELECT COUNT(*) FROM requests").fetchone()
+
+      new_bucket = check(bucket, request_count)
+
+      connection.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                         (token, *new_bucket))
+      connection.execute("INSERT INTO requests VALUES (?)", (now,))
+      connection.execute("COMMIT")
+    except BaseException:
+      connection.execute("ROLLBACK")
+      raise
 
-  def __init__(self, limit=10000, period_in_seconds=60 * 60 * 24):
-    # Maps tokens to the last time they made a request.
-    # E.g, {"sometoken": datetime(2021, 8, 1, 0, 0, 0)}
-    self.last_request_times: Dict[str, datetime] = {}
 
-    # The number of requests made.
-    # This count is reset to zero at the end of each period.
-    self.request_count = 0
+class RateLimiter:
 
-    # The maximum number of requests allowed within the time period.
+  def __init__(self,
+               backend: RateLimiterBackend | None = None,
+               limit=10000,
+               period_in_seconds=60 * 60 * 24,
+               user_interval_in_seconds=5,
+               user_burst=1,
+               token_ttl_in_seconds=60 * 60 * 24):
+    self.backend = backend or InMemoryBackend()
+
+    # Each user gains a request every `user_interval_in_seconds` and can
+    # save up to `user_burst` requests.
+    self.user_interval = user_interval_in_seconds
+    self.user_burst = user_burst
+
+    # Tokens unused for this long are removed.
+    self.token_ttl = token_ttl_in_seconds
+
+    # The maximum number of requests allowed within any sliding window of
+    # the period.
     self.limit = limit
-
-    self.scheduler = background.BackgroundScheduler()
-    self.scheduler.add_job(self._remove_old_tokens,
-                           "interval",
-                           seconds=60 * 60 * 24)
-    self.scheduler.add_job(self._reset_request_count,
-                           "interval",
-                           seconds=period_in_seconds)
-    self.scheduler.start()
+    self.period = period_in_seconds
 
   def check_rate_limit(self, token: str):
-    if not token or not self.token_exists(token):
+    if not token:
       raise InvalidTokenException()
 
-    if (datetime.now() - self.last_request_times[token]).seconds < 5:
-      raise UserRateLimitException()
+    # Wall-clock time is used since the state can be shared by processes.
+    now = time.time()
 
-    if self.request_count >= self.limit:
-      raise SystemRateLimitException()
+    def check(bucket: Bucket | None, request_count: int) -> Bucket:
+      if bucket is None:
+        raise InvalidTokenException()
 
-    self.last_request_times[token] = datetime.now()
-    self.request_count += 1
+      available, used_at = bucket
+      available = min(self.user_burst,
+                      available + (now - used_at) / self.user_interval)
+      if available < 1:
+        raise UserRateLimitException()
+
+      if request_count >= self.limit:
+        raise SystemRateLimitException()
+
+      return available - 1, now
+
+    self.backend.acquire(token, now, now - self.period, now - self.token_ttl,
+                         check)
 
   def initialize_request(self, token: str):
-    self.last_request_times[token] = datetime.min
+    self.backend.set_bucket(token, (self.user_burst, time.time()))
 
   def token_exists(self, token: str):
-    return token in self.last_request_times
+    return self.backend.token_exists(token)
+
 
-  def _remove_old_tokens(self):
-    for token, last_request_time in dict(self.last_request_times).items():
-      if (datetime.now() - last_request_time).days >= 1:
-        del self.last_request_times[token]
+# Set RATE_LIMIT_BACKEND to "sqlite" to share the rate limits between server
+# processes on the same machine.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "rate_limit.db")
 
-  def _reset_request_count(self):
-    self.request_count = 0
 
+def create_backend(name: str) -> RateLimiterBackend:
+  if name == "memory":
+    return InMemoryBackend()
 
-rate_limiter = RateLimiter()
+  if name == "sqlite":
+    return SqliteBackend(RATE_LIMIT_DB_PATH)
+
+  raise ValueError(f"Invalid rate limit backend: {name}")
+
+
+rate_limiter = RateLimiter(create_backend(RATE_LIMIT_BACKEND))
 
 
 def set_token(app: gr.Blocks, token: gr.Textbox):
@@ -112,14 +266,3 @@ def set_token(app: gr.Blocks, token: gr.Textbox):
            inputs=[token],
            outputs=[token])
   token.change(fn=lambda _: None, js=set_client_token, inputs=[token])
-
-
-def signal_handler(sig, frame):
-  del sig, frame  # Unused.
-  rate_limiter.scheduler.shutdown()
-  sys.exit(0)
-
-
-if gr.NO_RELOAD:
-  # Catch signal to ensure scheduler shuts down when server stops.
-  signal.signal(signal.SIGINT, signal_handler)
@@ -0,0 +1,370 @@
+"""
+This module contains the rating engines used by the leaderboard.
+"""
+
+from dataclasses import dataclass
+import enum
+import math
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+  import db
+
+
+class RatingEngine(enum.Enum):
+  ELO = "elo"
+  BRADLEY_TERRY = "bradley_terry"
+
+
+# Values of the winner codes used in the battle arrays.
+WINNER_CODES = {"model_a": 0, "model_b": 1, "tie": 2}
+WINNER_NAMES = np.array(list(WINNER_CODES))
+
+
+# Folds the battles into the given ratings in place and returns them.
+# Ref: https://colab.research.google.com/drive/1RAWb22-PFNI-X1gPVzc927SGUdfr6nsR?usp=sharing#scrollTo=QLGc6DwxyvQc pylint: disable=line-too-long
+def update_elo(ratings: Dict[str, float],
+               battles: List["db.Battle"],
+               k=4,
+               scale=400,
+               base=10,
+               initial_rating=1000) -> Dict[str, float]:
+  return _fold_elo(
+      ratings,
+      ((battle.model_a, battle.model_b, battle.winner) for battle in battles),
+      k, scale, base, initial_rating)
+
+
+# Folds (model A, model B, winner) tuples into the ratings in place.
+def _fold_elo(ratings: Dict[str, float],
+              outcomes: Iterable[Tuple[str, str, str]],
+              k=4,
+              scale=400,
+              base=10,
+              initial_rating=1000) -> Dict[str, float]:
+  for model_a, model_b, winner in outcomes:
+    rating_a = ratings.setdefault(model_a, initial_rating)
+    rating_b = ratings.setdefault(model_b, initial_rating)
+
+    expected_score_a = 1 / (1 + base**((rating_b - rating_a) / scale))
+    expected_score_b = 1 / (1 + base**((rating_a - rating_b) / scale))
+
+    scored_point_a = 0.5 if winner == "tie" else int(winner == "model_a")
+
+    ratings[model_a] += k * (scored_point_a - expected_score_a)
+    ratings[model_b] += k * (1 - scored_point_a - expected_score_b)
+
+  return ratings
+
+
+# Same as `update_elo`, but folds in battle columns. The ratings are indexed
+# by the interned model IDs while folding, so that model names are not
+# looked up for each battle.
+def update_elo_columns(ratings: Dict[str, float],
+                       battles: "db.BattleColumns",
+                       k=4,
+                       scale=400,
+                       base=10,
+                       initial_rating=1000) -> Dict[str, float]:
+  model_ratings = [
+      ratings.get(model, initial_rating) for model in battles.models
+  ]
+  scored_points = {
+      WINNER_CODES["model_a"]: 1,
+      WINNER_CODES["model_b"]: 0,
+      WINNER_CODES["tie"]: 0.5
+  }
+
+  for model_a, model_b, winner in zip(battles.model_a.tolist(),
+                                      battles.model_b.tolist(),
+                                      battles.winner.tolist()):
+    rating_a = model_ratings[model_a]
+    rating_b = model_ratings[model_b]
+
+    expected_score_a = 1 / (1 + base**((rating_b - rating_a) / scale))
+    expected_score_b = 1 / (1 + base**((rating_a - rating_b) / scale))
+
+    scored_point_a = scored_points[winner]
+
+    model_ratings[model_a] += k * (scored_point_a - expected_score_a)
+    model_ratings[model_b] += k * (1 - scored_point_a - expected_score_b)
+
+  ratings.update(zip(battles.models, model_ratings))
+  return ratings
+
+
+def round_ratings(ratings: Dict[str, float]) -> Dict[str, int]:
+  return {model: math.floor(rating + 0.5) for model, rating in ratings.items()}
+
+
+def compute_elo(battles: List["db.Battle"],
+                k=4,
+                scale=400,
+                base=10,
+                initial_rating=1000) -> Dict[str, int]:
+  return round_ratings(update_elo({}, battles, k, scale, base, initial_rating))
+
+
+@dataclass
+class PairCounts:
+  models: List[str]
+  # wins[i, j] is the number of battles models[i] won against models[j].
+  wins: np.ndarray
+  # ties[i, j] is the number of ties between models[i] and models[j].
+  # It is symmetric.
+  ties: np.ndarray
+
+  @classmethod
+  def empty(cls) -> "PairCounts":
+    return cls([], np.zeros((0, 0), dtype=np.int64),
+               np.zeros((0, 0), dtype=np.int64))
+
+  @classmethod
+  def from_dicts(cls, wins: Dict[str, Dict[str, int]],
+                 ties: Dict[str, Dict[str, int]]) -> "PairCounts":
+    counts = cls.empty()
+    for model, opponents in list(wins.items()) + list(ties.items()):
+      counts._get_index(model)
+      for opponent in opponents:
+        counts._get_index(opponent)
+
+    indices = {model: index for index, model in enumerate(counts.models)}
+    for matrix, source in ((counts.wins, wins), (counts.ties, ties)):
+      for model, opponents in source.items():
+        for opponent, count in opponents.items():
+          matrix[indices[model], indices[opponent]] = count
+    return counts
+
+  # Returns (wins, ties) as nested dictionaries, omitting zero counts.
+  def to_dicts(self):
+    return self._to_dict(self.wins), self._to_dict(self.ties)
+
+  def add_arrays(self, models: List[str], model_a: np.ndarray,
+                 model_b: np.ndarray, winner: np.ndarray):
+    # Maps the indices of the given models to the indices of this instance.
+    mapping = np.array([self._get_index(model) for model in models],
+                       dtype=np.int64)
+    num_models = len(self.models)
+    index_a = mapping[model_a]
+    index_b = mapping[model_b]
+
+    pairs = index_a * num_models + index_b
+    reversed_pairs = index_b * num_models + index_a
+    size = num_models * num_models
+    self.wins += np.bincount(pairs[winner == WINNER_CODES["model_a"]],
+                             minlength=size).reshape(num_models, num_models)
+    self.wins += np.bincount(reversed_pairs[winner == WINNER_CODES["model_b"]],
+                             minlength=size).reshape(num_models, num_models)
+    tie_counts = np.bincount(pairs[winner == WINNER_CODES["tie"]],
+                             minlength=size).reshape(num_models, num_models)
+    self.ties += tie_counts + tie_counts.T
+
+  # Returns (model_a, model_b, winner) arrays with one entry per battle,
+  # indexed by `models`. The original order of the battles is not kept.
+  def to_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    win_counts = self.wins.ravel()
+    # Each tie is stored in both directions.
+    tie_counts = np.triu(self.ties).ravel()
+    pairs = np.repeat(np.tile(np.arange(win_counts.size), 2),
+                      np.concatenate([win_counts, tie_counts]))
+    winner = np.repeat(
+        np.array([WINNER_CODES["model_a"], WINNER_CODES["tie"]], dtype=np.int8),
+        [win_counts.sum(), tie_counts.sum()])
+    num_models = len(self.models)
+    return pairs // num_models, pairs % num_models, winner
+
+  # Returns the number of battles each model has played.
+  def num_battles(self) -> Dict[str, int]:
+    totals = self.wins.sum(axis=1) + self.wins.sum(axis=0) + self.ties.sum(
+        axis=1)
+    return {model: int(total) for model, total in zip(self.models, totals)}
+
+  def _to_dict(self, matrix: np.ndarray) -> Dict[str, Dict[str, int]]:
+    result = {}
+    for i, j in zip(*np.nonzero(matrix)):
+      result.setdefault(self.models[i], {})[self.models[j]] = int(matrix[i, j])
+    return result
+
+  def _get_index(self, model: str) -> int:
+    if model in self.models:
+      return self.models.index(model)
+
+    self.models.append(model)
+    self.wins = np.pad(self.wins, ((0, 1), (0, 1)))
+    self.ties = np.pad(self.ties, ((0, 1), (0, 1)))
+    return len(self.models) - 1
+
+
+# Fits a Bradley-Terry model by maximizing the L2-regularized likelihood with
+# Newton's method, which is a logistic regression over model pairs. Ties
+# count as half a win for each model. Unlike Elo, the result does not depend
+# on the order of the battles.
+def fit_bradley_terry(counts: PairCounts,
+                      scale=400,
+                      base=10,
+                      initial_rating=1000,
+                      regularization=1e-6,
+                      max_iterations=100,
+                      tolerance=1e-8) -> Dict[str, float]:
+  if not counts.models:
+    return {}
+
+  scores = counts.wins + 0.5 * counts.ties
+  games = counts.wins + counts.wins.T + counts.ties
+
+  strengths = np.zeros(len(counts.models))
+  for _ in range(max_iterations):
+    win_probabilities = 1 / (1 +
+                             np.exp(strengths[None, :] - strengths[:, None]))
+    gradient = (scores - games * win_probabilities).sum(
+        axis=1) - regularization * strengths
+
+    weights = games * win_probabilities * win_probabilities.T
+    hessian = np.diag(weights.sum(
+        axis=1)) - weights + regularization * np.eye(len(counts.models))
+
+    step = np.linalg.solve(hessian, gradient)
+    strengths += step
+    if np.abs(step).max() < tolerance:
+      break
+
+  strengths -= strengths.mean()
+  ratings = initial_rating + scale / math.log(base) * strengths
+  return {model: float(rating) for model, rating in zip(counts.models, ratings)}
+
+
+def _compute_sample(models: List[str], model_a: np.ndarray, model_b: np.ndarray,
+                    winner: np.ndarray, engine: RatingEngine) -> List[float]:
+  if engine == RatingEngine.ELO:
+    ratings = _fold_elo({},
+                        zip(model_a.tolist(), model_b.tolist(),
+                            WINNER_NAMES[winner].tolist()))
+    # Models that are missing from the sample are ignored.
+    return [ratings.get(index, np.nan) for index in range(len(models))]
+
+  counts = PairCounts.empty()
+  counts.add_arrays(models, model_a, model_b, winner)
+  ratings = fit_bradley_terry(counts)
+  return [ratings[model] for model in models]
+
+
+# Runs a bootstrap round and returns the ratings in the order of
+# `counts.models`.
+def _bootstrap_round(counts: PairCounts, engine: RatingEngine,
+                     seed: np.random.SeedSequence) -> List[float]:
+  rng = np.random.default_rng(seed)
+  model_a, model_b, winner = counts.to_arrays()
+  indices = rng.integers(0, len(winner), size=len(winner))
+  return _compute_sample(counts.models, model_a[indices], model_b[indices],
+                         winner[indices], engine)
+
+
+# The helper process that runs the bootstrap rounds. It is kept across calls
+# and started again only if it exits.
+_helper: subprocess.Popen | None = None
+# Held while a request is sent to the helper and its reply is read.
+_helper_lock = threading.Lock()
+_HELPER_CODE = "import rating; rating.serve_bootstrap_rounds()"
+
+
+# Returns the helper, starting it if it is not running. The worker processes
+# of multiprocessing import the main module of their parent again, which for
+# app.py would build the whole app. The helper is started with `-c`, so that
+# it has no main module, rather than from the server. It is started in its
+# own session, so that Ctrl+C reaches the server only, and exits once the
+# server closes its end of the pipe.
+def _get_helper() -> subprocess.Popen:
+  # pylint: disable=global-statement
+  global _helper
+  if _helper is None or _helper.poll() is not None:
+    # pylint: disable=consider-using-with
+    _helper = subprocess.Popen([sys.executable, "-c", _HELPER_CODE],
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               start_new_session=True)
+  return _helper
+
+
+# Runs the bootstrap rounds requested by `bootstrap_intervals` until stdin is
+# closed, and replies with the ratings of the rounds finished within the time
+# budget. The unfinished rounds are stopped along with their workers. The
+# workers are forked from a server process that has imported only this
+# module, so that they start quickly.
+def serve_bootstrap_rounds():
+  # The replies are written to the original stdout, and anything else printed
+  # goes to stderr.
+  replies = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+  os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+  context = multiprocessing.get_context("forkserver")
+  context.set_forkserver_preload(["rating"])
+  pool = None
+  while True:
+    try:
+      counts, engine, rounds, time_budget = pickle.load(sys.stdin.buffer)
+    except EOFError:
+      break
+
+    deadline = time.monotonic() + time_budget
+    if pool is None:
+      pool = context.Pool(os.cpu_count() or 1)
+    results = [
+        pool.apply_async(_bootstrap_round, (counts, engine, seed))
+        for seed in np.random.SeedSequence().spawn(rounds)
+    ]
+    for result in results:
+      result.wait(max(deadline - time.monotonic(), 0))
+
+    done = [result.get() for result in results if result.ready()]
+    if len(done) < len(results):
+      pool.terminate()
+      pool = None
+
+    pickle.dump(done, replies)
+    replies.flush()
+
+  if pool is not None:
+    pool.terminate()
+
+
+# Returns the 95% confidence interval of each model's rating, which is
+# estimated from the ratings of battles resampled with replacement.
+# The rounds are spread across the worker processes of a helper process, and
+# only the rounds finished within `time_budget` seconds are used.
+def bootstrap_intervals(counts: PairCounts, engine: RatingEngine, rounds: int,
+                        time_budget: float) -> Dict[str, Tuple[int, int]]:
+  if not counts.models or rounds <= 0:
+    return {}
+
+  with _helper_lock:
+    helper = _get_helper()
+    pickle.dump((counts, engine, rounds, time_budget), helper.stdin)
+    helper.stdin.flush()
+    done = pickle.load(helper.stdout)
+
+  if not done:
+    return {}
+
+  samples = np.array(done)
+  # A model may be missing from every finished round, e.g., if few rounds
+  # finished in time. It is left without an interval.
+  has_samples = np.isfinite(samples).any(axis=0)
+  models = [
+      model for model, has_sample in zip(counts.models, has_samples.tolist())
+      if has_sample
+  ]
+  lower, upper = np.nanpercentile(samples[:, has_samples], [2.5, 97.5], axis=0)
+  return {
+      model: (math.floor(low + 0.5), math.floor(high + 0.5))
+      for model, low, high in zip(models, lower, upper)
+  }
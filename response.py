@@ -2,51 +2,86 @@
 This module contains functions for generating responses using LLMs.
 """
 
+from concurrent import futures
+from dataclasses import dataclass
 import enum
+import functools
 import logging
-from random import sample
-from typing import List
-from uuid import uuid4
+import math
+import os
+from random import choice
+import time
+from typing import Callable, Dict, List, Tuple
 
-from firebase_admin import firestore
 import gradio as gr
 
-from db import db
+from chunking import CHUNK_TOKENS
+from chunking import ChunkPlan
+from chunking import create_chunk_plan
+from chunking import should_chunk
+from chunking import summarize_in_chunks
+from db import add_history
+from db import Category as BattleCategory
+from metrics import CompletionStats
+from model import CompletionTimeoutError
 from model import ContextWindowExceededError
+from model import count_tokens
+from model import estimate_input_tokens
+from model import get_available_models
 from model import Model
-from model import supported_models
 import rate_limit
 from rate_limit import rate_limiter
+from sampling import pair_sampler
+import tracing
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Shared by all requests to bound the number of concurrent completions.
+completion_executor = futures.ThreadPoolExecutor(max_workers=32)
 
-# TODO(#37): Move DB operations to db.py.
-def get_history_collection(category: str):
-  if category == Category.SUMMARIZE.value:
-    return db.collection("arena-summarization-history")
-
-  if category == Category.TRANSLATE.value:
-    return db.collection("arena-translation-history")
+# Streamed responses are sent to the client at most once per this many
+# seconds, rather than once per received token.
+STREAM_FRAME_INTERVAL = 0.1
 
+# The seconds each model in a battle has to produce its response. A model that
+# misses it is replaced by another one, at most MAX_MODEL_REPLACEMENTS times
+# per battle.
+RESPONSE_DEADLINE = float(os.getenv("RESPONSE_DEADLINE", "60"))
+MAX_MODEL_REPLACEMENTS = int(os.getenv("MAX_MODEL_REPLACEMENTS", "2"))
 
-def create_history(category: str, model_name: str, instruction: str,
-                   prompt: str, response: str):
-  doc_id = uuid4().hex
 
+# `replaced_model` is the name of the model that missed its deadline and was
+# replaced by this one, if any. `chunk_plan` is set if the prompt was
+# summarized in chunks. `stats` is the usage of the response. `trace_id` is
+# shared by the responses and the vote of a battle.
+def create_history(category: str,
+                   model_name: str,
+                   instruction: str,
+                   prompt: str,
+                   response: str,
+                   replaced_model: str | None = None,
+                   chunk_plan: ChunkPlan | None = None,
+                   stats: CompletionStats | None = None,
+                   trace_id: str | None = None):
   doc = {
-      "id": doc_id,
       "model": model_name,
       "instruction": instruction,
       "prompt": prompt,
       "response": response,
-      "timestamp": firestore.SERVER_TIMESTAMP
   }
+  if replaced_model:
+    doc["replaced_model"] = replaced_model
+  if chunk_plan:
+    doc["chunk_plan"] = chunk_plan.to_dict()
+  if stats:
+    doc["stats"] = stats.to_dict()
+  if trace_id:
+    doc["trace_id"] = trace_id
 
-  doc_ref = get_history_collection(category).document(doc_id)
-  doc_ref.set(doc)
+  with tracing.span("create_history", model=model_name):
+    add_history(BATTLE_CATEGORIES[category], doc)
 
 
 class Category(enum.Enum):
@@ -54,6 +89,24 @@ class Category(enum.Enum):
   TRANSLATE = "Translate"
 
 
+# The category of the battles that the votes of each category become.
+BATTLE_CATEGORIES = {
+    Category.SUMMARIZE.value: BattleCategory.SUMMARIZATION,
+    Category.TRANSLATE.value: BattleCategory.TRANSLATION,
+}
+
+# The output tokens expected of each category, relative to the prompt tokens.
+# A summary is not longer than its text, while a translation into a script
+# that takes more tokens per character can be longer.
+OUTPUT_TOKEN_RATIOS = {
+    Category.SUMMARIZE.value: 1.0,
+    Category.TRANSLATE.value: 2.0,
+}
+# Output tokens added to every budget, for the output format and short
+# prompts.
+BASE_OUTPUT_TOKENS = int(os.getenv("BASE_OUTPUT_TOKENS", "256"))
+
+
 # TODO(#31): Let the model builders set the instruction.
 def get_instruction(category: str, model: Model, source_lang: str,
                     target_lang: str):
@@ -65,6 +118,68 @@ def get_instruction(category: str, model: Model, source_lang: str,
                                               target_lang=target_lang)
 
 
+# Returns the max_tokens of each of the models whose context window fits a
+# prompt of `prompt_tokens` tokens and the output it is expected to take.
+def get_token_budgets(models: List[Model], category: str, prompt_tokens: int,
+                      source_lang: str, target_lang: str) -> Dict[str, int]:
+  output_tokens = BASE_OUTPUT_TOKENS + math.ceil(
+      prompt_tokens * OUTPUT_TOKEN_RATIOS[category])
+
+  budgets = {}
+  for model in models:
+    instruction = get_instruction(category, model, source_lang, target_lang)
+    max_tokens = model.get_max_tokens(
+        estimate_input_tokens(instruction, prompt_tokens), output_tokens)
+    if max_tokens is not None:
+      budgets[model.name] = max_tokens
+  return budgets
+
+
+def get_response(category: str,
+                 model: Model,
+                 instruction: str,
+                 prompt: str,
+                 on_partial: Callable[[str], None] | None = None,
+                 deadline: float | None = None,
+                 replaced_model: str | None = None,
+                 max_tokens: int | None = None,
+                 chunk_plan: ChunkPlan | None = None,
+                 trace_id: str | None = None) -> Tuple[str, bool]:
+  with tracing.span("get_response",
+                    trace_id,
+                    model=model.name,
+                    chunks=len(chunk_plan.chunks) if chunk_plan else 0):
+    stats = CompletionStats()
+    start = time.perf_counter()
+    # TODO(#1): Allow user to set configuration.
+    if chunk_plan:
+      response, is_valid_response = summarize_in_chunks(model, instruction,
+                                                        chunk_plan, max_tokens,
+                                                        on_partial, deadline,
+                                                        stats)
+    else:
+      response, is_valid_response = model.completion(instruction,
+                                                     prompt,
+                                                     max_tokens=max_tokens,
+                                                     on_partial=on_partial,
+                                                     deadline=deadline,
+                                                     stats=stats)
+    stats.wall_time = time.perf_counter() - start
+
+    create_history(category, model.name, instruction, prompt, response,
+                   replaced_model, chunk_plan, stats, trace_id)
+    return response, is_valid_response
+
+
+# A model's completion in a battle.
+@dataclass
+class BattleSlot:
+  model: Model
+  instruction: str
+  task: futures.Future
+  deadline: float
+
+
 def get_responses(prompt: str, category: str, source_lang: str,
                   target_lang: str, token: str):
   if not category:
@@ -74,8 +189,12 @@ def get_responses(prompt: str, category: str, source_lang: str,
                                                not target_lang):
     raise gr.Error("Please select source and target languages.")
 
+  # The responses and the vote of the battle are traced under this ID.
+  trace_id = tracing.new_trace_id()
+
   try:
-    rate_limiter.check_rate_limit(token)
+    with tracing.span("check_rate_limit", trace_id):
+      rate_limiter.check_rate_limit(token)
   except rate_limit.InvalidTokenException as e:
     raise gr.Error(
         "Your session has expired. Please refresh the page to continue.") from e
@@ -88,38 +207,123 @@ def get_responses(prompt: str, category: str, source_lang: str,
         "Our service is currently experiencing high traffic. Please try again later."  # pylint: disable=line-too-long
     ) from e
 
-  models: List[Model] = sample(list(supported_models), 2)
-  responses = []
-  got_invalid_response = False
-  for model in models:
+  available_models = get_available_models()
+  if len(available_models) < 2:
+    raise gr.Error(
+        "Not enough models are available right now. Please try again later.")
+
+  # Long texts are summarized in chunks, with the same chunks for both
+  # models so that their summaries are comparable.
+  prompt_tokens = count_tokens(prompt)
+  chunk_plan = None
+  if category == Category.SUMMARIZE.value and should_chunk(prompt_tokens):
+    chunk_plan = create_chunk_plan(prompt)
+    prompt_tokens = CHUNK_TOKENS
+
+  # Models whose context window cannot fit the prompt are not sampled, rather
+  # than failing after a round trip to the provider.
+  token_budgets = get_token_budgets(available_models, category, prompt_tokens,
+                                    source_lang, target_lang)
+  available_models = [
+      model for model in available_models if model.name in token_budgets
+  ]
+  if len(available_models) < 2:
+    raise gr.Error(
+        "The prompt is too long. Please try again with a shorter prompt.")
+
+  index_a, index_b = pair_sampler.sample(
+      BATTLE_CATEGORIES[category].value,
+      [model.name for model in available_models])
+  models: List[Model] = [available_models[index_a], available_models[index_b]]
+
+  # Both models are called concurrently and stream their partial results
+  # into this list, so the latency is that of the slower one.
+  partial_responses = ["", ""]
+
+  def start_completion(index: int,
+                       model: Model,
+                       replaced_model: str | None = None) -> BattleSlot:
     instruction = get_instruction(category, model, source_lang, target_lang)
-    try:
-      # TODO(#1): Allow user to set configuration.
-      response, is_valid_response = model.completion(instruction, prompt)
-      create_history(category, model.name, instruction, prompt, response)
-      responses.append(response)
+    deadline = time.monotonic() + RESPONSE_DEADLINE
+    task = completion_executor.submit(
+        get_response, category, model, instruction, prompt,
+        functools.partial(partial_responses.__setitem__, index), deadline,
+        replaced_model, token_budgets[model.name], chunk_plan, trace_id)
+    return BattleSlot(model, instruction, task, deadline)
+
+  slots = [start_completion(index, model) for index, model in enumerate(models)]
+  # Models that have been part of this battle are not picked as replacements.
+  used_model_names = {model.name for model in models}
+  num_replacements = 0
+
+  # Coalesces the streamed deltas of both models into time-based frames.
+  last_frame = None
+  while True:
+    futures.wait([slot.task for slot in slots],
+                 timeout=STREAM_FRAME_INTERVAL,
+                 return_when=futures.FIRST_EXCEPTION)
+
+    # A model past its deadline stops at its next chunk on its own, so it is
+    # left behind and its slot is given to another model.
+    now = time.monotonic()
+    for index, slot in enumerate(slots):
+      timed_out = slot.task.done() and isinstance(slot.task.exception(),
+                                                  CompletionTimeoutError)
+      if not timed_out and (slot.task.done() or now < slot.deadline):
+        continue
+      if num_replacements >= MAX_MODEL_REPLACEMENTS:
+        continue
 
-      if not is_valid_response:
-        got_invalid_response = True
+      candidates = [
+          model for model in get_available_models()
+          if model.name in token_budgets and model.name not in used_model_names
+      ]
+      if not candidates:
+        continue
+
+      replacement = choice(candidates)
+      logger.warning("Model %s missed its deadline. Replacing it with %s.",
+                     slot.model.name, replacement.name)
+      used_model_names.add(replacement.name)
+      num_replacements += 1
+      partial_responses[index] = ""
+      slots[index] = start_completion(index, replacement, slot.model.name)
+
+    tasks = [slot.task for slot in slots]
+    if all(task.done() for task in tasks) or any(
+        task.exception() for task in tasks if task.done()):
+      break
+
+    model_names = [slot.model.name for slot in slots]
+    frame = partial_responses + model_names
+    if frame != last_frame:
+      yield frame + [slots[-1].instruction, trace_id]
+      last_frame = frame
+
+  # Checks the finished tasks first, so that a failure is surfaced without
+  # waiting for the other model.
+  for slot in sorted(slots, key=lambda slot: not slot.task.done()):
+    try:
+      slot.task.result()
 
     except ContextWindowExceededError as e:
-      logger.exception("Context window exceeded for model %s.", model.name)
+      logger.exception("Context window exceeded for model %s.", slot.model.name)
       raise gr.Error(
           "The prompt is too long. Please try again with a shorter prompt."
       ) from e
+    except CompletionTimeoutError as e:
+      logger.exception("Model %s timed out.", slot.model.name)
+      raise gr.Error(
+          "The models took too long to respond. Please try again.") from e
     except Exception as e:
-      logger.exception("Failed to get response from model %s.", model.name)
+      logger.exception("Failed to get response from model %s.", slot.model.name)
       raise gr.Error("Failed to get response. Please try again.") from e
 
+  responses = [slot.task.result()[0] for slot in slots]
+  got_invalid_response = not all(slot.task.result()[1] for slot in slots)
+
   if got_invalid_response:
     gr.Warning("An invalid response was received.")
 
-  model_names = [model.name for model in models]
-
-  # It simulates concurrent stream response generation.
-  max_response_length = max(len(response) for response in responses)
-  for i in range(max_response_length):
-    yield [response[:i + 1] for response in responses
-          ] + model_names + [instruction]
-
-  yield responses + model_names + [instruction]
+  model_names = [slot.model.name for slot in slots]
+  yield responses + model_names + [slots[-1].instruction, trace_id]
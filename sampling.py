@@ -0,0 +1,112 @@
+"""
+This module samples the pairs of models that battle each other.
+
+The adaptive strategy favors pairs whose outcome is uncertain, i.e., whose
+ratings are close, and that have been compared only a few times, so that the
+leaderboard converges with fewer votes. With probability `exploration`, a
+pair is sampled uniformly at random instead, so that every pair keeps being
+compared.
+"""
+
+import enum
+import os
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from rating import PairCounts
+
+
+class SamplingStrategy(enum.Enum):
+  UNIFORM = "uniform"
+  ADAPTIVE = "adaptive"
+
+
+SAMPLING_STRATEGY = SamplingStrategy(os.getenv("SAMPLING_STRATEGY", "adaptive"))
+SAMPLING_EXPLORATION = float(os.getenv("SAMPLING_EXPLORATION", "0.2"))
+
+
+# Returns a symmetric matrix of the sampling weights of the pairs of `models`.
+# The weight of a pair is the variance of its outcome, p * (1 - p), which is
+# the most a battle can tell about the pair, divided by the number of times
+# the pair has already been compared. Models without a rating start at
+# `initial_rating`, so new models are favored until they have been compared.
+def get_pair_weights(models: List[str],
+                     ratings: Dict[str, float],
+                     counts: PairCounts,
+                     scale=400,
+                     base=10,
+                     initial_rating=1000) -> np.ndarray:
+  model_ratings = np.array(
+      [ratings.get(model, initial_rating) for model in models], dtype=float)
+  win_probabilities = 1 / (1 + base**(
+      (model_ratings[None, :] - model_ratings[:, None]) / scale))
+
+  known_indices = {model: index for index, model in enumerate(counts.models)}
+  games = counts.wins + counts.wins.T + counts.ties
+  pair_games = np.zeros((len(models), len(models)))
+  for i, model in enumerate(models):
+    for j, opponent in enumerate(models):
+      if model in known_indices and opponent in known_indices:
+        pair_games[i, j] = games[known_indices[model], known_indices[opponent]]
+
+  weights = win_probabilities * (1 - win_probabilities) / (1 + pair_games)
+  np.fill_diagonal(weights, 0)
+  return weights
+
+
+# Returns the indices of two different models sampled by their pair weights,
+# or uniformly at random with probability `exploration`. The order of the
+# pair is random.
+def sample_pair(weights: np.ndarray, exploration: float,
+                rng: np.random.Generator) -> Tuple[int, int]:
+  num_models = len(weights)
+  upper = np.triu(weights, k=1)
+  if rng.random() < exploration or upper.sum() <= 0:
+    upper = np.triu(np.ones((num_models, num_models)), k=1)
+
+  pair = rng.choice(upper.size, p=upper.ravel() / upper.sum())
+  index_a, index_b = divmod(int(pair), num_models)
+  if rng.random() < 0.5:
+    return index_b, index_a
+  return index_a, index_b
+
+
+class PairSampler:
+
+  def __init__(self,
+               strategy: SamplingStrategy = SamplingStrategy.ADAPTIVE,
+               exploration=0.2,
+               seed: int | None = None):
+    self.strategy = strategy
+    self.exploration = exploration
+
+    # The latest ratings and pair counts of each category.
+    self._stats: Dict[str, Tuple[Dict[str, float], PairCounts]] = {}
+    self._rng = np.random.default_rng(seed)
+    # Generators are not thread-safe.
+    self._lock = threading.Lock()
+
+  def update(self, category: str, ratings: Dict[str, float],
+             counts: PairCounts):
+    with self._lock:
+      self._stats[category] = (dict(ratings), counts)
+
+  # Returns the indices of the two models to battle. Pairs are sampled
+  # uniformly at random until the category has stats.
+  def sample(self, category: str, models: List[str]) -> Tuple[int, int]:
+    if len(models) < 2:
+      raise ValueError("At least two models are required.")
+
+    with self._lock:
+      stats = self._stats.get(category)
+      if self.strategy == SamplingStrategy.UNIFORM or stats is None:
+        weights = np.ones((len(models), len(models)))
+        np.fill_diagonal(weights, 0)
+      else:
+        weights = get_pair_weights(models, *stats)
+      return sample_pair(weights, self.exploration, self._rng)
+
+
+pair_sampler = PairSampler(SAMPLING_STRATEGY, SAMPLING_EXPLORATION)
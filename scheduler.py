@@ -0,0 +1,51 @@
+"""
+This module provides the background scheduler shared by periodic jobs and
+runs the registered shutdown hooks when the server stops.
+"""
+
+import signal
+import sys
+import threading
+from typing import Callable, List
+
+from apscheduler.schedulers import background
+import gradio as gr
+
+scheduler = background.BackgroundScheduler()
+scheduler.start()
+
+_shutdown_hooks: List[Callable[[], None]] = []
+_shutdown_lock = threading.Lock()
+_shutdown_done = threading.Event()
+
+
+# Registers a function to run when the server stops, e.g., to commit queued
+# writes.
+def add_shutdown_hook(hook: Callable[[], None]):
+  _shutdown_hooks.append(hook)
+
+
+# Stops the scheduler and runs the shutdown hooks, once even if it is called
+# again, e.g., by a signal during the shutdown.
+def shutdown():
+  with _shutdown_lock:
+    if _shutdown_done.is_set():
+      return
+    _shutdown_done.set()
+
+  scheduler.shutdown()
+  for hook in _shutdown_hooks:
+    hook()
+
+
+def signal_handler(sig, frame):
+  del sig, frame  # Unused.
+  shutdown()
+  sys.exit(0)
+
+
+if gr.NO_RELOAD:
+  # Catch signals to ensure scheduler shuts down and shutdown hooks run when
+  # server stops. SIGTERM is what container runtimes send to stop it.
+  signal.signal(signal.SIGINT, signal_handler)
+  signal.signal(signal.SIGTERM, signal_handler)
@@ -0,0 +1,26 @@
+"""
+This module provides SQLite connections that are kept per thread, as SQLite
+connections cannot be shared between threads.
+"""
+
+import sqlite3
+import threading
+
+
+class ThreadLocalConnection:
+
+  def __init__(self, path: str):
+    self.path = path
+    self._local = threading.local()
+
+  # Returns the connection of the current thread, opening it on first use.
+  # Each statement is committed on its own, so transactions have to be begun
+  # explicitly. The database is shared by the server processes, so it is
+  # opened in WAL mode to let reads run alongside a write.
+  def get(self) -> sqlite3.Connection:
+    connection = getattr(self._local, "connection", None)
+    if connection is None:
+      connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+      connection.execute("PRAGMA journal_mode=WAL")
+      self._local.connection = connection
+    return connection
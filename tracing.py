@@ -0,0 +1,190 @@
+"""
+This module provides lightweight tracing of where the time of a battle goes.
+
+A span times a block of code and is a child of the span that encloses it. The
+spans of a battle share its trace ID, from the rate limit check to the vote,
+so they can be put together even though they are made by separate requests.
+
+Only traces sampled by TRACE_SAMPLE_RATE are recorded. The decision is made
+from the trace ID, so every request of a battle makes the same one.
+"""
+
+from abc import ABC
+from abc import abstractmethod
+from collections import deque
+import contextlib
+import contextvars
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Iterator, List
+from uuid import uuid4
+
+import gradio as gr
+
+from scheduler import add_shutdown_hook
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+# "memory" keeps the last TRACE_BUFFER_SIZE spans in memory, and "jsonl"
+# appends the spans to the file at TRACE_PATH.
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "memory")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "10000"))
+TRACE_PATH = os.getenv("TRACE_PATH", "traces.jsonl")
+
+
+@dataclass
+class Span:
+  name: str
+  trace_id: str
+  span_id: str
+  parent_id: str | None
+  # Seconds since the epoch.
+  start_time: float
+  duration: float = 0.0
+  attributes: dict = field(default_factory=dict)
+  # The type of the exception that ended the span, if any.
+  error: str | None = None
+
+
+# The trace and span that new spans are children of. The span ID is None for
+# traces that are not sampled.
+@dataclass
+class _SpanContext:
+  trace_id: str
+  span_id: str | None
+  sampled: bool
+
+
+_current_span: "contextvars.ContextVar[_SpanContext | None]" = (
+    contextvars.ContextVar("current_span", default=None))
+
+
+class SpanExporter(ABC):
+
+  @abstractmethod
+  def export(self, finished_span: Span):
+    pass
+
+  def close(self):
+    pass
+
+
+# Keeps the most recent spans in memory.
+class RingBufferExporter(SpanExporter):
+
+  def __init__(self, size: int):
+    self._spans = deque(maxlen=size)
+    self._lock = threading.Lock()
+
+  def export(self, finished_span: Span):
+    with self._lock:
+      self._spans.append(finished_span)
+
+  def spans(self) -> List[Span]:
+    with self._lock:
+      return list(self._spans)
+
+
+# Appends the spans to a file as JSON lines.
+class JsonlExporter(SpanExporter):
+
+  def __init__(self, path: str):
+    self._file = open(path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+    self._lock = threading.Lock()
+
+  def export(self, finished_span: Span):
+    line = json.dumps(asdict(finished_span), ensure_ascii=False, default=str)
+    with self._lock:
+      self._file.write(line + "\n")
+      self._file.flush()
+
+  def close(self):
+    with self._lock:
+      self._file.close()
+
+
+def create_exporter(name: str) -> SpanExporter:
+  if name == "memory":
+    return RingBufferExporter(TRACE_BUFFER_SIZE)
+  if name == "jsonl":
+    return JsonlExporter(TRACE_PATH)
+  raise ValueError(f"Unknown trace exporter: {name}")
+
+
+if gr.NO_RELOAD:
+  exporter = create_exporter(TRACE_EXPORTER)
+  add_shutdown_hook(exporter.close)
+
+
+def new_trace_id() -> str:
+  return uuid4().hex
+
+
+def is_sampled(trace_id: str) -> bool:
+  return int(trace_id[:8], 16) < TRACE_SAMPLE_RATE * 0x100000000
+
+
+# Times the block as a span of the given trace, or of the enclosing span's
+# trace if `trace_id` is not given. A block outside of any span starts a new
+# trace. Yields the span, or None if the trace is not sampled.
+@contextlib.contextmanager
+def span(name: str,
+         trace_id: str | None = None,
+         **attributes) -> Iterator[Span | None]:
+  parent = _current_span.get()
+  parent_id = None
+  if trace_id is None and parent is not None:
+    trace_id = parent.trace_id
+    parent_id = parent.span_id
+  elif trace_id is None:
+    trace_id = new_trace_id()
+  elif parent is not None and parent.trace_id == trace_id:
+    parent_id = parent.span_id
+
+  if not is_sampled(trace_id):
+    token = _current_span.set(_SpanContext(trace_id, None, False))
+    try:
+      yield None
+    finally:
+      _current_span.reset(token)
+    return
+
+  new_span = Span(name, trace_id,
+                  uuid4().hex[:16], parent_id, time.time(), 0.0, attributes)
+  token = _current_span.set(_SpanContext(trace_id, new_span.span_id, True))
+  start = time.perf_counter()
+  try:
+    yield new_span
+  except BaseException as e:
+    new_span.error = type(e).__name__
+    raise
+  finally:
+    new_span.duration = time.perf_counter() - start
+    _current_span.reset(token)
+    exporter.export(new_span)
+
+
+# Wraps the function so that it runs as a span of the given name.
+def traced(name: str) -> Callable[[Callable], Callable]:
+
+  def decorator(fn: Callable) -> Callable:
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      with span(name):
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+  return decorator
+
+
+# Returns the function bound to the current span, so that the spans it makes
+# in another thread, e.g., of an executor, are children of it.
+def bind(fn: Callable) -> Callable:
+  return functools.partial(contextvars.copy_context().run, fn)